@@ -1,12 +1,31 @@
-from django.contrib import admin
-from .models import Inquiry, UserProfile, PaymentLog
+from django.contrib import admin, messages
+from django.db import transaction
+from django.utils.html import format_html_join
+from django.utils.safestring import mark_safe
+from .models import (
+    Area, AreaAlias, BackgroundTask, BrokerImport, City, CityAlias, Inquiry, InquiryArchive,
+    PaymentLog, PropertyType, PropertyTypeAlias, UserProfile,
+)
+from . import locations, search
+from .tasks import import_brokers as import_brokers_task
+from .changelists import AutocompleteFilter, CachedRelatedOnlyFilter, ScalableAdminMixin
 
 # Register your models here.
-class InquiryAdmin(admin.ModelAdmin):
+class InquiryAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ('id', 'transaction_type', 'city', 'area', 'property_type', 'created_at')
-    list_filter = ('transaction_type', 'property_type', 'city', 'created_at')
-    search_fields = ('city', 'area', 'property_type')
+    list_filter = (
+        'transaction_type',
+        ('property_type', CachedRelatedOnlyFilter),
+        ('city', CachedRelatedOnlyFilter),
+        'created_at',
+    )
+    search_fields = ('city__name', 'area__name', 'property_type__name')
     readonly_fields = ('created_at',)
+    list_select_related = ('city', 'area', 'property_type')
+    autocomplete_fields = ('city', 'area', 'property_type')
+    # Rows are created in primary-key order, so this matches newest first
+    # and keeps the keyset pagination.
+    ordering = ('-pk',)
 
     fieldsets = (
         (None, {
@@ -20,13 +39,133 @@ class InquiryAdmin(admin.ModelAdmin):
         }),
     )
 
+    def get_search_results(self, request, queryset, search_term):
+        # Served by the full-text index instead of LIKE scans over the joins.
+        return search.filter_queryset(queryset, search_term), False
+
 admin.site.register(Inquiry, InquiryAdmin)
-admin.site.register(UserProfile)
+
+
+class CityAliasInline(admin.TabularInline):
+    model = CityAlias
+    extra = 0
+
+
+class AreaAliasInline(admin.TabularInline):
+    model = AreaAlias
+    extra = 0
+    fk_name = 'area'
+    # Always the area's own city; AreaAlias.save fills it in.
+    exclude = ('city',)
+
+
+class PropertyTypeAliasInline(admin.TabularInline):
+    model = PropertyTypeAlias
+    extra = 0
+
+
+@admin.action(description="Merge selected into the oldest one")
+def merge_selected(modeladmin, request, queryset):
+    target, *duplicates = queryset.order_by('pk')
+    try:
+        moved = locations.merge(target, duplicates)
+    except ValueError as exc:
+        modeladmin.message_user(request, str(exc), messages.ERROR)
+        return
+    modeladmin.message_user(
+        request, f"Merged {len(duplicates)} row(s) into {target}; {moved} inquiries moved."
+    )
+
+
+class CityAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name')
+    search_fields = ('name', 'aliases__key')
+    inlines = [CityAliasInline]
+    actions = [merge_selected]
+
+
+class AreaAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'city')
+    list_filter = ('city',)
+    search_fields = ('name', 'aliases__key')
+    list_select_related = ('city',)
+    inlines = [AreaAliasInline]
+    actions = [merge_selected]
+
+
+class PropertyTypeAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name')
+    search_fields = ('name', 'aliases__key')
+    inlines = [PropertyTypeAliasInline]
+    actions = [merge_selected]
+
+admin.site.register(City, CityAdmin)
+admin.site.register(Area, AreaAdmin)
+admin.site.register(PropertyType, PropertyTypeAdmin)
+
+
+class UserProfileAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'full_name', 'email', 'user_type', 'has_paid', 'created_at')
+    list_filter = ('user_type', 'has_paid')
+    # Exact and prefix lookups can use the unique indexes on email and
+    # national_id; they also back the broker autocomplete in PaymentLogAdmin.
+    search_fields = ('=email', '=national_id', '^full_name')
+    readonly_fields = ('created_at',)
+    list_per_page = 50
+    ordering = ('-pk',)
+    change_list_template = 'admin/inquiries/userprofile/change_list.html'
+
+admin.site.register(UserProfile, UserProfileAdmin)
+
+
+class BrokerImportAdmin(admin.ModelAdmin):
+    list_display = ('id', 'status', 'dry_run', 'created', 'skipped', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    readonly_fields = ('status', 'created', 'skipped_rows', 'created_at', 'finished_at')
+    fieldsets = (
+        (None, {
+            'fields': ('csv_file', 'images', 'dry_run'),
+            'description': (
+                f"One broker per row. Required columns: {', '.join(BrokerImport.REQUIRED_COLUMNS)}. "
+                "An optional license_image column names a file in the ZIP. "
+                "The import runs in the background; this page shows the outcome."
+            ),
+        }),
+        ('Outcome', {
+            'fields': ('status', 'created', 'skipped_rows', 'created_at', 'finished_at'),
+        }),
+    )
+
+    def get_readonly_fields(self, request, obj=None):
+        if obj is not None:
+            return ('csv_file', 'images', 'dry_run') + self.readonly_fields
+        return self.readonly_fields
+
+    def get_fieldsets(self, request, obj=None):
+        return self.fieldsets if obj is not None else self.fieldsets[:1]
+
+    @admin.display(description='Skipped')
+    def skipped(self, obj):
+        return len(obj.errors)
+
+    @admin.display(description='Skipped rows')
+    def skipped_rows(self, obj):
+        return format_html_join(mark_safe('<br>'), 'Line {}: {}', obj.errors) or '-'
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if not change:
+            # The worker must see the row and the uploaded files.
+            transaction.on_commit(lambda: import_brokers_task.delay(obj.pk))
+            self.message_user(request, "The import was queued; reload this page to see the outcome.")
+
+admin.site.register(BrokerImport, BrokerImportAdmin)
+
 
 # New Admin class for PaymentLog
-class PaymentLogAdmin(admin.ModelAdmin):
+class PaymentLogAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ('id', 'broker', 'amount', 'payment_date', 'payment_method', 'status', 'transaction_id')
-    list_filter = ('status', 'payment_method', 'broker', 'payment_date')
+    list_filter = ('status', 'payment_method', ('broker', AutocompleteFilter), 'payment_date')
     search_fields = ('broker__full_name', 'broker__email', 'transaction_id')
     readonly_fields = ('created_at', 'updated_at', 'payment_date')
     list_per_page = 25
@@ -49,3 +188,30 @@ class PaymentLogAdmin(admin.ModelAdmin):
         return qs.select_related('broker')
 
 admin.site.register(PaymentLog, PaymentLogAdmin)
+
+
+class BackgroundTaskAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'name', 'status', 'attempts', 'run_at', 'locked_by', 'finished_at')
+    list_filter = ('status',)
+    search_fields = ('^name',)
+    readonly_fields = ('created_at', 'finished_at', 'locked_by', 'locked_at', 'last_error')
+    list_per_page = 50
+    actions = ['requeue']
+
+    @admin.action(description="Requeue selected tasks")
+    def requeue(self, request, queryset):
+        updated = queryset.update(status=BackgroundTask.STATUS_QUEUED, attempts=0, locked_by='', locked_at=None)
+        self.message_user(request, f"{updated} task(s) requeued.")
+
+admin.site.register(BackgroundTask, BackgroundTaskAdmin)
+
+
+class InquiryArchiveAdmin(admin.ModelAdmin):
+    list_display = ('month', 'rows', 'path', 'archived_until', 'updated_at')
+    readonly_fields = ('month', 'rows', 'path', 'archived_until', 'updated_at')
+
+    def has_add_permission(self, request):
+        # Entries are written by the archive_inquiries command only.
+        return False
+
+admin.site.register(InquiryArchive, InquiryArchiveAdmin)
@@ -3,4 +3,9 @@ from django.apps import AppConfig
 
 class InquiriesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
-    name = "inquiries"
\ No newline at end of file
+    name = "inquiries"
+
+    def ready(self):
+        # Connects the alias-cache invalidation, search indexing and
+        # search re-indexing signals.
+        from . import locations, search, tasks  # noqa: F401
@@ -0,0 +1,233 @@
+"""
+Hot/cold storage for inquiries.
+
+``archive_inquiries`` moves inquiries older than a cutoff out of the
+``Inquiry`` table, chunk by chunk, into one gzip-compressed NDJSON file per
+month under ``INQUIRY_ARCHIVE_DIR`` (default ``BASE_DIR / 'archive'``) and
+records each file in ``InquiryArchive``. Each run appends a new gzip member,
+which readers see as one continuous stream.
+
+Runs hold an exclusive lock on ``.lock`` in the archive directory, so two
+of them never append to the same file at once.
+
+``query()`` returns inquiries for a date range as dicts, newest first,
+reading the hot table and only opening archive files when the range
+reaches past the archive horizon.
+"""
+import contextlib
+import gzip
+import json
+import os
+from datetime import date, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils.dateparse import parse_datetime
+
+from .models import Inquiry, InquiryArchive
+from .search import unindex_many
+
+FIELDS = {
+    'id': 'id',
+    'transaction_type': 'transaction_type',
+    'city_id': 'city_id',
+    'city': 'city__name',
+    'area_id': 'area_id',
+    'area': 'area__name',
+    'property_type_id': 'property_type_id',
+    'property_type': 'property_type__name',
+    'bedrooms': 'bedrooms',
+    'bathrooms': 'bathrooms',
+    'min_price': 'min_price',
+    'max_price': 'max_price',
+    'min_size': 'min_size',
+    'max_size': 'max_size',
+    'furnished': 'furnished',
+    'created_at': 'created_at',
+}
+
+FILTERS = ('transaction_type', 'city_id', 'area_id', 'property_type_id')
+
+LOCK_FILE = '.lock'
+
+
+class ArchiveLocked(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def _exclusive(directory):
+    """
+    Holds an exclusive lock on the archive directory for the duration, or
+    raises ArchiveLocked when another process has it. The operating system
+    releases the lock if the process dies.
+    """
+    with open(directory / LOCK_FILE, 'a+b') as lock:
+        try:
+            if os.name == 'nt':
+                import msvcrt
+
+                msvcrt.locking(lock.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            raise ArchiveLocked(f"Another archive run holds {directory / LOCK_FILE}.")
+        yield
+
+
+def _delete_hot(pks):
+    # A single DELETE without loading the rows or sending signals; the
+    # search documents are removed by the caller and nothing else points
+    # at inquiries.
+    table = connection.ops.quote_name(Inquiry._meta.db_table)
+    column = connection.ops.quote_name(Inquiry._meta.pk.column)
+    placeholders = ', '.join(['%s'] * len(pks))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE {column} IN ({placeholders})', pks)
+
+
+def archive_dir():
+    return Path(getattr(settings, 'INQUIRY_ARCHIVE_DIR', settings.BASE_DIR / 'archive'))
+
+
+def _month(value):
+    # Partitions follow UTC months whatever the active time zone is.
+    value = value.astimezone(dt_timezone.utc)
+    return date(value.year, value.month, 1)
+
+
+def _hot_rows(queryset, chunk_size=2000):
+    names = list(FIELDS)
+    rows = queryset.values_list(*FIELDS.values())
+    for values in rows.iterator(chunk_size=chunk_size):
+        yield dict(zip(names, values))
+
+
+def archive_before(cutoff, chunk_size=5000, dry_run=False):
+    """
+    Moves every inquiry created before ``cutoff`` to cold storage and
+    returns how many were moved.
+
+    A chunk is written to its month file and closed before the rows are
+    deleted, so a crash can at worst leave rows in both places; readers
+    drop such duplicates by id. Raises ArchiveLocked while another run is
+    in progress.
+    """
+    directory = archive_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    old = Inquiry.objects.filter(created_at__lt=cutoff).order_by('pk')
+    if dry_run:
+        return old.count()
+    with _exclusive(directory):
+        return _archive(directory, old, cutoff, chunk_size)
+
+
+def _archive(directory, old, cutoff, chunk_size):
+    moved, last_pk = 0, 0
+    while True:
+        rows = list(_hot_rows(old.filter(pk__gt=last_pk)[:chunk_size]))
+        if not rows:
+            break
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(_month(row['created_at']), []).append(row)
+
+        for month, month_rows in by_month.items():
+            name = f'inquiries-{month:%Y-%m}.ndjson.gz'
+            with gzip.open(directory / name, 'at', encoding='utf-8') as stream:
+                for row in month_rows:
+                    stream.write(json.dumps(row, default=str, ensure_ascii=False))
+                    stream.write('\n')
+
+        pks = [row['id'] for row in rows]
+        with transaction.atomic():
+            for month, month_rows in by_month.items():
+                entry, _ = InquiryArchive.objects.select_for_update().get_or_create(
+                    month=month,
+                    defaults={'path': f'inquiries-{month:%Y-%m}.ndjson.gz', 'archived_until': cutoff},
+                )
+                entry.rows += len(month_rows)
+                entry.archived_until = max(entry.archived_until, cutoff)
+                entry.save(update_fields=['rows', 'archived_until', 'updated_at'])
+            unindex_many(pks)
+            _delete_hot(pks)
+        moved += len(rows)
+        last_pk = pks[-1]
+    return moved
+
+
+def horizon():
+    """
+    Returns the newest cutoff used by an archive run; nothing created at or
+    after it has been archived. None when nothing has been archived.
+    """
+    return InquiryArchive.objects.aggregate(until=Max('archived_until'))['until']
+
+
+def _matches(row, filters):
+    return all(row.get(name) == value for name, value in filters.items())
+
+
+def iter_archived(start=None, end=None, **filters):
+    """
+    Yields archived inquiries created in ``[start, end)`` as dicts, newest
+    first. One month is held in memory at a time.
+    """
+    months = InquiryArchive.objects.order_by('-month')
+    if start is not None:
+        months = months.filter(month__gte=_month(start))
+    if end is not None:
+        months = months.filter(month__lte=_month(end))
+
+    for entry in months:
+        path = archive_dir() / entry.path
+        if not path.exists():
+            continue
+        rows = {}
+        with gzip.open(path, 'rt', encoding='utf-8') as stream:
+            for line in stream:
+                row = json.loads(line)
+                row['created_at'] = parse_datetime(row['created_at'])
+                if start is not None and row['created_at'] < start:
+                    continue
+                if end is not None and row['created_at'] >= end:
+                    continue
+                if _matches(row, filters):
+                    rows[row['id']] = row
+        yield from sorted(rows.values(), key=lambda row: (row['created_at'], row['id']), reverse=True)
+
+
+def query(start=None, end=None, **filters):
+    """
+    Yields inquiries created in ``[start, end)`` from the hot table and, only
+    when the range starts before the archive horizon, from cold storage.
+    Accepts the keyword filters in ``FILTERS``. An inquiry that a crashed
+    archive run left in both places is returned once, from the hot table.
+    """
+    unknown = set(filters) - set(FILTERS)
+    if unknown:
+        raise TypeError(f"Unsupported filters: {', '.join(sorted(unknown))}")
+
+    hot = Inquiry.objects.filter(**filters).order_by('-created_at', '-id')
+    if start is not None:
+        hot = hot.filter(created_at__gte=start)
+    if end is not None:
+        hot = hot.filter(created_at__lt=end)
+    cold_until = horizon()
+    if cold_until is None or (start is not None and start >= cold_until):
+        yield from _hot_rows(hot)
+        return
+
+    # Only rows older than the horizon can also be in an archive file.
+    in_both = set()
+    for row in _hot_rows(hot):
+        if row['created_at'] < cold_until:
+            in_both.add(row['id'])
+        yield row
+    for row in iter_archived(start, end, **filters):
+        if row['id'] not in in_both:
+            yield row
@@ -0,0 +1,233 @@
+"""
+Bulk onboarding of brokers from a CSV file and a ZIP of license images.
+
+The CSV needs a header row with ``full_name``, ``email``, ``national_id``,
+``phone`` and ``password`` columns, and may add ``license_image`` naming a
+member of the ZIP. Rows are handled in chunks: one query finds the emails
+and national IDs already taken, passwords are hashed in a process pool
+(PBKDF2 dominates the cost of registering a broker), images are copied
+from the ZIP to storage one member at a time without extracting the
+archive, and the profiles are written with ``bulk_create``.
+
+Used by the ``import_brokers`` command and, for uploads made in the
+admin ("Broker imports"), by the ``import_brokers`` background task.
+"""
+import csv
+import io
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+import django
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.validators import validate_email
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import BrokerImport, UserProfile
+
+REQUIRED_COLUMNS = BrokerImport.REQUIRED_COLUMNS
+
+TRIAL_DAYS = 30
+
+# Inserts of one chunk, re-checked against the table in between, before
+# its remaining rows are reported as taken.
+INSERT_ATTEMPTS = 3
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.errors.append((line, message))
+
+
+def _open_csv(csv_file):
+    if isinstance(csv_file, (str, os.PathLike)):
+        return open(csv_file, newline='', encoding='utf-8-sig')
+    if isinstance(csv_file, io.TextIOBase):
+        return csv_file
+    # Uploaded files are binary.
+    return io.TextIOWrapper(csv_file, encoding='utf-8-sig', newline='')
+
+
+def _close_csv(stream, csv_file):
+    if isinstance(stream, io.TextIOWrapper) and stream.buffer is csv_file:
+        # Leaves the caller's file open.
+        stream.detach()
+    elif stream is not csv_file:
+        stream.close()
+
+
+def _chunks(reader, chunk_size):
+    chunk = []
+    # Line 1 is the header.
+    for line, row in enumerate(reader, start=2):
+        chunk.append((line, {key.strip(): (value or '').strip() for key, value in row.items() if key}))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _validate(chunk, seen, images, result):
+    """
+    Drops rows with missing or malformed values, or that repeat an email or
+    national ID seen earlier in the file.
+    """
+    valid = []
+    for line, row in chunk:
+        missing = [name for name in REQUIRED_COLUMNS if not row.get(name)]
+        if missing:
+            result.error(line, f"Missing {', '.join(missing)}")
+            continue
+        too_long = [
+            name for name in REQUIRED_COLUMNS
+            if len(row[name]) > (UserProfile._meta.get_field(name).max_length or len(row[name]))
+        ]
+        if too_long:
+            result.error(line, f"Too long: {', '.join(too_long)}")
+            continue
+        try:
+            validate_email(row['email'])
+        except ValidationError:
+            result.error(line, f"Invalid email {row['email']!r}")
+            continue
+        image = row.get('license_image')
+        if image and (images is None or image not in images):
+            result.error(line, f"License image {image!r} is not in the ZIP file")
+            continue
+        if row['email'] in seen['email'] or row['national_id'] in seen['national_id']:
+            result.error(line, "Email or national ID repeated in the file")
+            continue
+        seen['email'].add(row['email'])
+        seen['national_id'].add(row['national_id'])
+        valid.append((line, row))
+    return valid
+
+
+def _drop_existing(chunk, result):
+    emails = [row['email'] for _, row in chunk]
+    national_ids = [row['national_id'] for _, row in chunk]
+    taken_emails, taken_ids = set(), set()
+    for email, national_id in UserProfile.objects.filter(
+        Q(email__in=emails) | Q(national_id__in=national_ids)
+    ).values_list('email', 'national_id'):
+        taken_emails.add(email)
+        taken_ids.add(national_id)
+
+    available = []
+    for line, row in chunk:
+        if row['email'] in taken_emails:
+            result.error(line, "Email already exists")
+        elif row['national_id'] in taken_ids:
+            result.error(line, "National ID already exists")
+        else:
+            available.append((line, row))
+    return available
+
+
+def _store_image(archive, name, instance):
+    field = UserProfile._meta.get_field('license_image')
+    with archive.open(name) as member:
+        return field.storage.save(
+            field.generate_filename(instance, os.path.basename(name)), File(member)
+        )
+
+
+def import_brokers(csv_file, images_zip=None, chunk_size=500, workers=None, dry_run=False):
+    """
+    Creates a broker profile with a fresh trial for every valid CSV row and
+    returns an ``ImportResult``. ``csv_file`` and ``images_zip`` are paths
+    or file objects. Rows that fail are reported by CSV line and skipped;
+    with ``dry_run`` nothing is hashed or written.
+    """
+    result = ImportResult()
+    archive = zipfile.ZipFile(images_zip) if images_zip is not None else None
+    images = set(archive.namelist()) if archive is not None else None
+    seen = {'email': set(), 'national_id': set()}
+    stream = _open_csv(csv_file)
+    workers = workers or os.cpu_count() or 1
+    executor = None
+    try:
+        reader = csv.DictReader(stream)
+        missing = [name for name in REQUIRED_COLUMNS if name not in (reader.fieldnames or [])]
+        if missing:
+            result.error(1, f"Missing columns: {', '.join(missing)}")
+            return result
+
+        for chunk in _chunks(reader, chunk_size):
+            chunk = _drop_existing(_validate(chunk, seen, images, result), result)
+            if dry_run or not chunk:
+                result.created += len(chunk)
+                continue
+
+            if executor is None:
+                # Workers set Django up themselves when they are spawned
+                # rather than forked.
+                executor = ProcessPoolExecutor(max_workers=workers, initializer=django.setup)
+            hashes = executor.map(
+                make_password, [row['password'] for _, row in chunk],
+                chunksize=max(1, len(chunk) // (4 * workers)),
+            )
+
+            # Same trial as a broker who registers through the form.
+            trial_start = timezone.now()
+            profiles = []
+            stored = []
+            written = []
+            try:
+                for (line, row), password in zip(chunk, hashes):
+                    profile = UserProfile(
+                        user_type=UserProfile.USER_TYPE_BROKER,
+                        full_name=row['full_name'],
+                        email=row['email'],
+                        national_id=row['national_id'],
+                        phone=row['phone'],
+                        password=password,
+                        trial_start_date=trial_start,
+                        trial_end_date=trial_start + timedelta(days=TRIAL_DAYS),
+                        has_paid=False,
+                    )
+                    if row.get('license_image'):
+                        profile.license_image = _store_image(archive, row['license_image'], profile)
+                        stored.append(profile.license_image.name)
+                    profiles.append((line, row, profile))
+
+                pending = profiles
+                for _ in range(INSERT_ATTEMPTS):
+                    try:
+                        with transaction.atomic():
+                            UserProfile.objects.bulk_create([profile for _, _, profile in pending])
+                        written = pending
+                        break
+                    except IntegrityError:
+                        # Someone registered one of these between the check
+                        # and the insert; the rows still free are retried.
+                        free = {line for line, _ in _drop_existing([(line, row) for line, row, _ in pending], result)}
+                        pending = [item for item in pending if item[0] in free]
+                else:
+                    for line, _, _ in pending:
+                        result.error(line, "Email or national ID was taken during the import")
+            finally:
+                # Images of profiles that were not written, whatever stopped them.
+                kept = {profile.license_image.name for _, _, profile in written if profile.license_image}
+                storage = UserProfile._meta.get_field('license_image').storage
+                for name in stored:
+                    if name not in kept:
+                        storage.delete(name)
+            result.created += len(written)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        _close_csv(stream, csv_file)
+        if archive is not None:
+            archive.close()
+    return result
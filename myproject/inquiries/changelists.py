@@ -0,0 +1,286 @@
+"""
+Admin changelist building blocks that stay fast on large tables.
+
+``ScalableAdminMixin`` swaps the exact ``COUNT(*)`` for an estimate,
+pages with a cursor (``?before=``) instead of ``OFFSET`` while the default
+ordering is a single column, and hides facet counts. Two list filters go
+with it: ``AutocompleteFilter`` for foreign keys with many targets, and
+``CachedRelatedOnlyFilter`` for foreign keys whose used values are few but
+expensive to find.
+"""
+from django import forms
+from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ORDER_VAR, PAGE_VAR, ChangeList
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.db import connections
+from django.db.models import Max, Q, QuerySet
+from django.utils.functional import cached_property
+
+CURSOR_VAR = 'before'
+
+
+def estimate_rows(model, using='default'):
+    """
+    Returns the planner's row estimate for ``model``'s table, or None when
+    the backend keeps none. On SQLite the highest primary key stands in.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    if connection.vendor == 'postgresql':
+        sql = 'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass'
+    elif connection.vendor == 'mysql':
+        sql = (
+            'SELECT table_rows FROM information_schema.tables '
+            'WHERE table_schema = DATABASE() AND table_name = %s'
+        )
+    elif connection.vendor == 'sqlite' and model._meta.pk.get_internal_type() in ('AutoField', 'BigAutoField'):
+        return model._default_manager.using(using).aggregate(top=Max('pk'))['top'] or 0
+    else:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [table])
+        row = cursor.fetchone()
+    # PostgreSQL reports -1 for tables that were never analyzed.
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counts exactly only when that is cheap: the unfiltered table uses the
+    database estimate once it is past ``exact_below`` rows, and filtered
+    lists stop counting at ``count_cap``. Pages past an estimated or capped
+    count stay reachable; they are simply shorter or empty at the end.
+    """
+    exact_below = 10000
+    count_cap = 10000
+    is_estimate = False
+    is_capped = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet):
+            return super().count
+        if not queryset.query.where:
+            estimate = estimate_rows(queryset.model, queryset.db)
+            if estimate is not None and estimate >= self.exact_below:
+                self.is_estimate = True
+                return estimate
+        count = queryset.order_by()[:self.count_cap].count()
+        self.is_capped = count >= self.count_cap
+        return count
+
+    @property
+    def is_open_ended(self):
+        return self.count is not None and (self.is_estimate or self.is_capped)
+
+    def validate_number(self, number):
+        if not self.is_open_ended:
+            return super().validate_number(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(self.error_messages['invalid_page'])
+        if number < 1:
+            raise EmptyPage(self.error_messages['min_page'])
+        return number
+
+    def page(self, number):
+        if not self.is_open_ended:
+            return super().page(number)
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        return self._get_page(self.object_list[bottom:bottom + self.per_page], number, self)
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Pages with a cursor (``?before=``) under the default ordering when that
+    is a single non-null column, the primary key breaking ties, so every
+    page costs the same whatever its depth: ``-pk`` for inquiries,
+    ``-payment_date`` for payments. The column wants an index ending in the
+    primary key. Choosing a column to sort by, "show all" or list_editable
+    fall back to numbered pages.
+    """
+    keyset = False
+    keyset_field = None
+    descending = True
+    next_page_url = None
+
+    def __init__(self, request, *args, **kwargs):
+        self.cursor = request.GET.get(CURSOR_VAR) or None
+        super().__init__(request, *args, **kwargs)
+        # Filter and sort links must start again from the first rows.
+        self.params.pop(CURSOR_VAR, None)
+        self.filter_params.pop(CURSOR_VAR, None)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def cursor_ordering(self, request):
+        """
+        Returns (field, descending) for keyset paging under the default
+        ordering, or None when it is not a single non-null column.
+        """
+        # ChangeList appends '-pk' to any ordering, so none at all is '-pk' too.
+        ordering = list(self.model_admin.get_ordering(request) or self._get_default_ordering())
+        if not ordering:
+            return self.lookup_opts.pk, True
+        if len(ordering) != 1 or not isinstance(ordering[0], str):
+            return None
+        name = ordering[0].lstrip('-')
+        try:
+            field = self.lookup_opts.pk if name == 'pk' else self.lookup_opts.get_field(name)
+        except FieldDoesNotExist:
+            return None
+        if not field.concrete or field.is_relation or field.null:
+            return None
+        return field, ordering[0].startswith('-')
+
+    def _encode_cursor(self, row):
+        if self.keyset_field.primary_key:
+            return str(row.pk)
+        return f'{self.keyset_field.value_to_string(row)},{row.pk}'
+
+    def _after_cursor(self, queryset):
+        field, pk = self.keyset_field, self.lookup_opts.pk
+        try:
+            if field.primary_key:
+                return queryset.filter(**{'pk__lt' if self.descending else 'pk__gt': pk.to_python(self.cursor)})
+            value, last_pk = self.cursor.rsplit(',', 1)
+            value, last_pk = field.to_python(value), pk.to_python(last_pk)
+        except (ValueError, ValidationError):
+            raise IncorrectLookupParameters
+        # The range condition alone lets the index seek; the OR only breaks
+        # ties on the column.
+        before, strictly = ('lte', 'lt') if self.descending else ('gte', 'gt')
+        return queryset.filter(**{f'{field.name}__{before}': value}).filter(
+            Q(**{f'{field.name}__{strictly}': value}) | Q(**{f'pk__{strictly}': last_pk})
+        )
+
+    def get_results(self, request):
+        ordering = None
+        if ORDER_VAR not in self.params and not self.show_all and not self.list_editable:
+            ordering = self.cursor_ordering(request)
+        self.keyset = ordering is not None
+        if not self.keyset:
+            super().get_results(request)
+            if (
+                self.multi_page and self.paginator.is_open_ended
+                and len(self.result_list) == self.list_per_page
+            ):
+                # Past the count the numbers run out; this link does not.
+                self.next_page_url = self.get_query_string({PAGE_VAR: self.page_num + 1})
+            return
+
+        self.keyset_field, self.descending = ordering
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        sign = '-' if self.descending else ''
+        queryset = self.queryset.order_by(f'{sign}{self.keyset_field.name}', f'{sign}pk')
+        if self.cursor is not None:
+            queryset = self._after_cursor(queryset)
+        rows = list(queryset[:self.list_per_page + 1])
+        result_list = rows[:self.list_per_page]
+        has_next = len(rows) > self.list_per_page
+
+        self.result_count = paginator.count
+        self.show_full_result_count = self.model_admin.show_full_result_count
+        self.full_result_count = self.root_queryset.count() if self.show_full_result_count else None
+        self.show_admin_actions = not self.show_full_result_count or bool(self.full_result_count)
+        self.result_list = result_list
+        self.can_show_all = False
+        self.multi_page = has_next or self.cursor is not None
+        self.paginator = paginator
+        self.first_page_url = self.get_query_string(remove=[CURSOR_VAR, PAGE_VAR])
+        self.next_page_url = (
+            self.get_query_string({CURSOR_VAR: self._encode_cursor(result_list[-1])}, remove=[PAGE_VAR])
+            if has_next else None
+        )
+
+
+class ScalableAdminMixin:
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    @property
+    def media(self):
+        media = super().media
+        if any(isinstance(item, tuple) and issubclass(item[1], AutocompleteFilter)
+               for item in self.list_filter):
+            media += AutocompleteSelect(None, self.admin_site).media
+        return media
+
+
+class AutocompleteFilter(admin.RelatedFieldListFilter):
+    """
+    A foreign-key filter that searches its targets through the admin
+    autocomplete view instead of listing them all. The target model's admin
+    needs ``search_fields``.
+    """
+    template = 'admin/inquiries/autocomplete_filter.html'
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.model_admin = model_admin
+        super().__init__(field, request, params, model, model_admin, field_path)
+
+    def field_choices(self, field, request, model_admin):
+        # Nothing is enumerated; the widget loads the selected target itself.
+        return []
+
+    def has_output(self):
+        return True
+
+    def rendered_widget(self):
+        widget = AutocompleteSelect(
+            self.field, self.model_admin.admin_site, attrs={'data-filter-param': self.lookup_kwarg}
+        )
+        form_field = forms.ModelChoiceField(
+            queryset=self.field.remote_field.model._default_manager.all(),
+            widget=widget,
+            required=False,
+        )
+        value = self.lookup_val[-1] if self.lookup_val else None
+        return form_field.widget.render(f'autocomplete-filter-{self.field_path}', value)
+
+
+class CachedRelatedOnlyFilter(admin.RelatedFieldListFilter):
+    """
+    Lists only the targets that rows actually use, like
+    RelatedOnlyFieldListFilter, but runs the DISTINCT over the foreign-key
+    column once per ``cache_timeout`` instead of on every page load.
+    """
+    cache_timeout = 600
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.model = model
+        self.field_path = field_path
+        super().__init__(field, request, params, model, model_admin, field_path)
+
+    def field_choices(self, field, request, model_admin):
+        key = f'admin-filter:{self.model._meta.label_lower}:{self.field_path}'
+        choices = cache.get(key)
+        if choices is None:
+            used = (
+                self.model._default_manager.order_by()
+                .filter(**{f'{self.field_path}__isnull': False})
+                .values_list(self.field_path, flat=True).distinct()
+            )
+            choices = field.get_choices(
+                include_blank=False,
+                limit_choices_to={'pk__in': list(used)},
+                ordering=self.field_admin_ordering(field, request, model_admin),
+            )
+            cache.set(key, choices, self.cache_timeout)
+        return choices
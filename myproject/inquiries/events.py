@@ -0,0 +1,319 @@
+"""
+Pub/sub that pushes new inquiries to connected broker pages.
+
+``create_inquiry`` publishes an event once its transaction commits. The
+configured backend carries it to every worker process and hands it to that
+process's ``hub``, which fans it out to the asyncio queues of matching
+subscribers. Subscribers never touch the database while they wait; only the
+backend's listener thread does, once per process.
+
+Settings (all optional)::
+
+    INQUIRY_EVENTS = {
+        'BACKEND': 'inquiries.events.PollingBackend',
+        'HEARTBEAT_SECONDS': 15,
+        'QUEUE_SIZE': 100,
+        'POLL_SECONDS': 1,
+        'CHANNEL': 'inquiry_events',
+    }
+
+Backends:
+
+``PollingBackend``
+    Works on any database: a thread in each process that has subscribers
+    reads the inquiries created since its last look every ``POLL_SECONDS``.
+    It follows the primary key, so on PostgreSQL, where concurrent
+    transactions can commit out of key order, prefer ``PostgresBackend``.
+``PostgresBackend``
+    Publishes with ``pg_notify`` on ``CHANNEL`` and ``LISTEN``\s on a
+    dedicated psycopg 3 connection per process. No polling delay.
+``LocalBackend``
+    Only reaches subscribers in the publishing process. Refuses to start
+    when ``WEB_CONCURRENCY`` (read by gunicorn and uvicorn) asks for more
+    than one worker.
+"""
+import abc
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, connections
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BACKEND': 'inquiries.events.PollingBackend',
+    'HEARTBEAT_SECONDS': 15,
+    'QUEUE_SIZE': 100,
+    'POLL_SECONDS': 1,
+    'CHANNEL': 'inquiry_events',
+}
+
+# Read with the row rather than from the posted form, so every subscriber
+# sees "Cairo" whether the form said "cairo" or "القاهرة".
+EVENT_COLUMNS = (
+    'id', 'transaction_type', 'city_id', 'area_id', 'property_type_id',
+    'city__name', 'area__name', 'property_type__name',
+    'bedrooms', 'bathrooms', 'min_price', 'max_price', 'furnished', 'created_at',
+)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'INQUIRY_EVENTS', {})}
+
+
+def event_from_row(row):
+    """Builds the published event from a row of ``EVENT_COLUMNS``."""
+    event = dict(zip(EVENT_COLUMNS, row))
+    for column in ('city', 'area', 'property_type'):
+        event[column] = event.pop(f'{column}__name') or ''
+    event['created_at'] = event['created_at'].isoformat()
+    return event
+
+
+def inquiry_events(queryset):
+    return [event_from_row(row) for row in queryset.values_list(*EVENT_COLUMNS)]
+
+
+class Subscription:
+    """
+    One connected client. Owned by the event loop that created it; other
+    threads hand events over with ``call_soon_threadsafe``.
+    """
+
+    def __init__(self, transaction_type=None, city_id=None, area_id=None, queue_size=100):
+        self.transaction_type = transaction_type
+        self.city_id = city_id
+        self.area_id = area_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+    def matches(self, event):
+        return (
+            (self.transaction_type is None or event['transaction_type'] == self.transaction_type)
+            and (self.city_id is None or event['city_id'] == self.city_id)
+            and (self.area_id is None or event['area_id'] == self.area_id)
+        )
+
+    def deliver(self, event):
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # The loop closed under a client that is about to unsubscribe.
+            pass
+
+    def _put(self, event):
+        if self.queue.full():
+            # A stalled client loses its oldest events rather than growing memory.
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+
+class Hub:
+    """
+    Subscriptions indexed by city so each event only visits the brokers who
+    watch that city or all cities.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_city = {}
+
+    def subscribe(self, subscription):
+        with self._lock:
+            self._by_city.setdefault(subscription.city_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            bucket = self._by_city.get(subscription.city_id)
+            if bucket is not None:
+                bucket.discard(subscription)
+                if not bucket:
+                    del self._by_city[subscription.city_id]
+
+    def dispatch(self, event):
+        with self._lock:
+            candidates = list(self._by_city.get(event['city_id'], ()))
+            if event['city_id'] is not None:
+                candidates.extend(self._by_city.get(None, ()))
+        for subscription in candidates:
+            if subscription.matches(event):
+                subscription.deliver(event)
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(bucket) for bucket in self._by_city.values())
+
+
+class EventBackend(abc.ABC):
+    """
+    Carries events between processes. ``publish`` is called in the process
+    that created the inquiry; implementations must end up calling
+    ``hub.dispatch(event)`` in every process that ``listen``\s, including
+    that one.
+    """
+
+    def __init__(self, hub, config):
+        self.hub = hub
+        self.config = config
+
+    @abc.abstractmethod
+    def publish(self, event):
+        """Sends ``event`` to every listening process."""
+
+    def listen(self):
+        """Called before each subscription; starts receiving if needed."""
+
+
+class LocalBackend(EventBackend):
+
+    def __init__(self, hub, config):
+        super().__init__(hub, config)
+        if int(os.environ.get('WEB_CONCURRENCY') or 1) > 1:
+            raise ImproperlyConfigured(
+                'LocalBackend only reaches subscribers in the publishing process; '
+                'use PollingBackend or PostgresBackend with several workers.'
+            )
+
+    def publish(self, event):
+        self.hub.dispatch(event)
+
+
+class ListenerBackend(EventBackend):
+    """
+    Backend whose process receives events on one daemon thread, started by
+    the first subscription.
+    """
+
+    def __init__(self, hub, config):
+        super().__init__(hub, config)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def listen(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=type(self).__name__, daemon=True,
+                )
+                self._thread.start()
+
+    @abc.abstractmethod
+    def _run(self):
+        """Receives events for the life of the process."""
+
+
+class PollingBackend(ListenerBackend):
+    """
+    The inquiry row is the message: ``publish`` has nothing to send, and the
+    listener reads new rows by primary key.
+    """
+
+    BATCH_SIZE = 500
+
+    def __init__(self, hub, config):
+        super().__init__(hub, config)
+        self.last_id = None
+
+    def publish(self, event):
+        pass
+
+    def poll(self):
+        """Dispatches inquiries created since the last call; returns how many."""
+        from .models import Inquiry
+
+        if self.last_id is None:
+            # Subscribers only want what is created after they connect.
+            self.last_id = Inquiry.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+            return 0
+        found = inquiry_events(
+            Inquiry.objects.filter(pk__gt=self.last_id).order_by('pk')[:self.BATCH_SIZE]
+        )
+        for event in found:
+            self.hub.dispatch(event)
+        if found:
+            self.last_id = found[-1]['id']
+        return len(found)
+
+    def _run(self):
+        while True:
+            try:
+                while self.poll() == self.BATCH_SIZE:
+                    pass
+            except Exception:
+                logger.exception('Polling for inquiry events failed')
+            finally:
+                connections.close_all()
+            time.sleep(self.config['POLL_SECONDS'])
+
+
+class PostgresBackend(ListenerBackend):
+    """
+    ``pg_notify`` runs on the request's connection, so with ``create_inquiry``
+    publishing on commit, listeners never see an inquiry that rolled back.
+    Payloads stay well under PostgreSQL's 8000 byte limit.
+    """
+
+    RECONNECT_SECONDS = 5
+
+    def __init__(self, hub, config):
+        super().__init__(hub, config)
+        if connection.vendor != 'postgresql':
+            raise ImproperlyConfigured('PostgresBackend needs PostgreSQL through psycopg 3.')
+        from django.db.backends.postgresql.psycopg_any import is_psycopg3
+
+        if not is_psycopg3:
+            raise ImproperlyConfigured('PostgresBackend needs PostgreSQL through psycopg 3.')
+
+    def publish(self, event):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.config['CHANNEL'], json.dumps(event)])
+
+    def _run(self):
+        import psycopg
+        from psycopg import sql
+
+        while True:
+            try:
+                params = connection.get_connection_params()
+                with psycopg.connect(**params, autocommit=True) as listener:
+                    listener.execute(
+                        sql.SQL('LISTEN {}').format(sql.Identifier(self.config['CHANNEL']))
+                    )
+                    for notify in listener.notifies():
+                        self.hub.dispatch(json.loads(notify.payload))
+            except Exception:
+                logger.exception('Listening for inquiry events failed; reconnecting')
+            time.sleep(self.RECONNECT_SECONDS)
+
+
+hub = Hub()
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = import_string(get_config()['BACKEND'])(hub, get_config())
+    return _backend
+
+
+def publish(event):
+    get_backend().publish(event)
+
+
+def subscribe(subscription):
+    get_backend().listen()
+    return hub.subscribe(subscription)
@@ -0,0 +1,418 @@
+"""
+Live "N matching" counts for the property search forms.
+
+Each worker keeps the facet columns of all hot inquiries in NumPy arrays,
+with a packed bitmap per transaction type, bedroom bucket and price bin.
+Those dimensions have a handful of codes; cities, areas and property types
+grow with every new spelling, so they are filtered by comparing their code
+column instead, which keeps memory at a few bytes per row. A call ANDs the
+packed masks of the active filters and counts each facet with ``bincount``
+over dense per-dimension codes (popcounts for the bitmap dimensions), so
+it costs no database time.
+
+A daemon thread builds the index and keeps it current: every
+``INQUIRY_FACETS['REFRESH_SECONDS']`` it appends the inquiries created since
+(``pk`` above the last one seen) to the columns and bitmaps in place, and
+every ``FULL_RELOAD_SECONDS`` it builds a fresh index to drop deleted or
+archived rows and pick up renamed lookups. Requests never wait on it; they
+read the latest published ``FacetSnapshot``, and get none until the first
+build is done (``inquiries.warmup`` builds it before a worker serves).
+
+As usual for facets, a dimension's own filter is left out when counting
+that dimension, so choosing a city still shows the counts of the others.
+"""
+import logging
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import connections
+
+from .models import Area, City, Inquiry, PropertyType
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'REFRESH_SECONDS': 5,
+    'FULL_RELOAD_SECONDS': 3600,
+    'CHUNK_SIZE': 20000,
+    'PRICE_BINS': [
+        0, 2500, 5000, 10000, 20000, 50000, 100000, 500000,
+        1000000, 2500000, 5000000, 10000000,
+    ],
+}
+
+# Bucket 0 means "not given"; 5 stands for five bedrooms or more.
+BEDROOM_BUCKETS = ['any', '1', '2', '3', '4', '5+']
+
+TRANSACTIONS = [Inquiry.TRANSACTION_RENT, Inquiry.TRANSACTION_SALE]
+
+COLUMNS = (
+    'pk', 'transaction_type', 'city_id', 'area_id', 'property_type_id',
+    'bedrooms', 'min_price', 'max_price',
+)
+
+# Lookup dimensions: ids are mapped to dense codes, 0 meaning "not set".
+LOOKUPS = {'city': City, 'area': Area, 'property_type': PropertyType}
+
+# Low-cardinality filters served by a packed bitmap per code.
+FILTER_BITMAPS = ('transaction_type', 'bedrooms')
+
+# Unbounded lookup filters, matched by comparing the code column.
+FILTER_CODES = ('city', 'area', 'property_type')
+
+# Dimensions with a packed bitmap per code; price bins only need them for
+# counting.
+BITMAP_DIMENSIONS = FILTER_BITMAPS + ('price',)
+
+FACETS = ('city', 'area', 'property_type', 'bedrooms', 'price')
+
+# Facets with at most this many codes are counted with popcounts over their
+# bitmaps, wider ones with a bincount over the unpacked mask.
+POPCOUNT_MAX_CODES = 64
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'INQUIRY_FACETS', {})}
+
+
+def bedroom_bucket(value):
+    if value is None or value == '':
+        return 0
+    return max(0, min(int(value), 5))
+
+
+class FacetSnapshot:
+    """
+    A read-only view of the first ``size`` rows of a ``FacetIndex``. The
+    writer only ever touches rows past ``size`` (or copies to new arrays),
+    so a snapshot stays consistent without locking.
+    """
+
+    def __init__(self, index):
+        self.size = size = index.size
+        self.nbytes = (size + 7) // 8
+        # Clears the bits past ``size`` in the last byte of a packed mask.
+        self.tail = (0xFF << (-size % 8)) & 0xFF
+        self.codes = {name: column[:size] for name, column in index.codes.items()}
+        self.low = index.low[:size]
+        self.high = index.high[:size]
+        self.price_bins = index.price_bins
+        self.bitmaps = {
+            dimension: {code: bitmap[:self.nbytes] for code, bitmap in bitmaps.items()}
+            for dimension, bitmaps in index.bitmaps.items()
+        }
+        self.code_of = {name: dict(mapping) for name, mapping in index.code_of.items()}
+        self.ids = {name: list(ids) for name, ids in index.ids.items()}
+        self.names = index.names
+        self._unfiltered = {}
+
+    def _code(self, dimension, value):
+        if dimension in LOOKUPS:
+            # -1 matches nothing: the id is unknown or has no inquiries yet.
+            return self.code_of[dimension].get(value, -1)
+        return value
+
+    def _filter_bits(self, filters):
+        """
+        Returns ``{dimension: packed bitmap}`` for every active filter.
+        """
+        bits = {}
+        for dimension in FILTER_BITMAPS:
+            if filters.get(dimension) is None:
+                continue
+            bitmap = self.bitmaps[dimension].get(self._code(dimension, filters[dimension]))
+            bits[dimension] = bitmap if bitmap is not None else np.zeros(self.nbytes, dtype=np.uint8)
+        for dimension in FILTER_CODES:
+            if filters.get(dimension) is not None:
+                bits[dimension] = np.packbits(
+                    self.codes[dimension] == self._code(dimension, filters[dimension])
+                )
+        if filters.get('min_price') is not None or filters.get('max_price') is not None:
+            mask = np.ones(self.size, dtype=bool)
+            if filters.get('min_price') is not None:
+                mask &= self.high >= filters['min_price']
+            if filters.get('max_price') is not None:
+                mask &= self.low <= filters['max_price']
+            bits['price'] = np.packbits(mask)
+        return bits
+
+    def _packed(self, bits, skip):
+        """
+        ANDs the packed filters except ``skip``, or returns None when no
+        filter applies (every row matches).
+        """
+        selected = [bitmap for dimension, bitmap in bits.items() if dimension != skip]
+        if not selected:
+            return None
+        packed = selected[0].copy()
+        for bitmap in selected[1:]:
+            packed &= bitmap
+        if self.nbytes:
+            packed[-1] &= self.tail
+        return packed
+
+    def _count(self, dimension, packed, length):
+        if packed is None:
+            if dimension not in self._unfiltered:
+                self._unfiltered[dimension] = np.bincount(self.codes[dimension], minlength=length)
+            return self._unfiltered[dimension]
+        bitmaps = self.bitmaps.get(dimension)
+        if bitmaps is not None and len(bitmaps) <= POPCOUNT_MAX_CODES:
+            counts = np.zeros(length, dtype=np.int64)
+            for code, bitmap in bitmaps.items():
+                counts[code] = np.bitwise_count(bitmap & packed).sum()
+            return counts
+        mask = np.unpackbits(packed, count=self.size).view(bool)
+        # Weighting by the mask is several times faster than codes[mask].
+        return np.bincount(self.codes[dimension], weights=mask, minlength=length).astype(np.int64)
+
+    def _lookup_counts(self, dimension, packed):
+        counts = self._count(dimension, packed, len(self.ids[dimension]))
+        ids, labels = self.ids[dimension], self.names[dimension]
+        codes = np.flatnonzero(counts[1:]) + 1
+        codes = codes[np.argsort(-counts[codes], kind='stable')]
+        return [
+            {'id': ids[code], 'name': labels.get(ids[code], ''), 'count': int(counts[code])}
+            for code in codes.tolist()
+        ]
+
+    def counts(self, filters):
+        """
+        ``filters`` holds lookup ids for city, area and property_type, an
+        index into TRANSACTIONS for transaction_type, a bedroom bucket and
+        min_price/max_price, each None when unset.
+        """
+        bits = self._filter_bits(filters)
+        # Facets whose own filter is not set all share the full mask.
+        masks = {None: self._packed(bits, None)}
+        for facet in FACETS:
+            if facet in bits:
+                masks[facet] = self._packed(bits, facet)
+
+        def mask_for(facet):
+            return masks[facet if facet in bits else None]
+
+        full = masks[None]
+        bedroom_counts = self._count('bedrooms', mask_for('bedrooms'), len(BEDROOM_BUCKETS))
+        # Price codes are shifted by one; code 0 holds budgets without prices.
+        price_counts = self._count('price', mask_for('price'), len(self.price_bins) + 1)[1:]
+        edges = self.price_bins.tolist() + [None]
+        return {
+            'total': self.size if full is None else int(np.bitwise_count(full).sum()),
+            'city': self._lookup_counts('city', mask_for('city')),
+            # The area facet keeps the city filter, so it lists that city's areas.
+            'area': self._lookup_counts('area', mask_for('area')),
+            'property_type': self._lookup_counts('property_type', mask_for('property_type')),
+            'bedrooms': [
+                {'bucket': label, 'count': int(count)}
+                for label, count in zip(BEDROOM_BUCKETS, bedroom_counts.tolist())
+            ],
+            'price': [
+                {'min': int(edges[i]), 'max': None if edges[i + 1] is None else int(edges[i + 1]),
+                 'count': count}
+                for i, count in enumerate(price_counts.tolist())
+            ],
+        }
+
+
+class FacetIndex:
+    """
+    Growable facet columns. Only the refresh thread calls ``append``;
+    readers use the snapshot it publishes.
+    """
+
+    def __init__(self, price_bins):
+        self.price_bins = np.asarray(price_bins, dtype=np.float64)
+        self.size = 0
+        self.capacity = 0
+        self.last_pk = 0
+        # Counted columns are intp, which bincount uses without a copy.
+        self.codes = {
+            'transaction_type': np.empty(0, dtype=np.int8),
+            'city': np.empty(0, dtype=np.intp),
+            'area': np.empty(0, dtype=np.intp),
+            'property_type': np.empty(0, dtype=np.intp),
+            'bedrooms': np.empty(0, dtype=np.intp),
+            'price': np.empty(0, dtype=np.intp),
+        }
+        self.low = np.empty(0, dtype=np.float64)
+        self.high = np.empty(0, dtype=np.float64)
+        self.bitmaps = {dimension: {} for dimension in BITMAP_DIMENSIONS}
+        self.code_of = {name: {} for name in LOOKUPS}
+        self.ids = {name: [None] for name in LOOKUPS}
+        self.names = {name: {} for name in LOOKUPS}
+        self.snapshot = FacetSnapshot(self)
+
+    def _reserve(self, size):
+        if size <= self.capacity:
+            return
+        capacity = max(size, 2 * self.capacity, 1024)
+        capacity += -capacity % 8
+
+        def grow(array, length, used):
+            grown = np.zeros(length, dtype=array.dtype)
+            grown[:used] = array[:used]
+            return grown
+
+        # New arrays, so published snapshots keep the old ones intact.
+        used_bytes = (self.size + 7) // 8
+        self.codes = {name: grow(column, capacity, self.size) for name, column in self.codes.items()}
+        self.low = grow(self.low, capacity, self.size)
+        self.high = grow(self.high, capacity, self.size)
+        self.bitmaps = {
+            dimension: {code: grow(bitmap, capacity // 8, used_bytes) for code, bitmap in bitmaps.items()}
+            for dimension, bitmaps in self.bitmaps.items()
+        }
+        self.capacity = capacity
+
+    def _encode(self, name, values):
+        code_of, ids = self.code_of[name], self.ids[name]
+        new_ids = []
+        codes = np.empty(len(values), dtype=np.intp)
+        for i, value in enumerate(values):
+            if value is None:
+                codes[i] = 0
+                continue
+            code = code_of.get(value)
+            if code is None:
+                code = code_of[value] = len(ids)
+                ids.append(value)
+                new_ids.append(value)
+            codes[i] = code
+        if new_ids:
+            self.names[name] = {
+                **self.names[name],
+                **dict(LOOKUPS[name].objects.filter(pk__in=new_ids).values_list('pk', 'name')),
+            }
+        return codes
+
+    def append(self, rows):
+        """
+        Adds ``values_list(*COLUMNS)`` rows in primary-key order and
+        publishes a new snapshot.
+        """
+        if not rows:
+            return
+        data = dict(zip(COLUMNS, zip(*rows)))
+        count = len(rows)
+        start, end = self.size, self.size + count
+        self._reserve(end)
+
+        codes = {
+            'transaction_type': np.fromiter(
+                (TRANSACTIONS.index(v) if v in TRANSACTIONS else 0 for v in data['transaction_type']),
+                dtype=np.int8, count=count,
+            ),
+            'city': self._encode('city', data['city_id']),
+            'area': self._encode('area', data['area_id']),
+            'property_type': self._encode('property_type', data['property_type_id']),
+            'bedrooms': np.fromiter(
+                (bedroom_bucket(v) for v in data['bedrooms']), dtype=np.intp, count=count
+            ),
+        }
+        low = np.fromiter((v or 0 for v in data['min_price']), dtype=np.float64, count=count)
+        high = np.fromiter(
+            (np.inf if v is None else v for v in data['max_price']), dtype=np.float64, count=count
+        )
+        # A budget falls in the bin of its upper bound, or of its lower bound
+        # when it is open-ended. Codes start at 1; 0 is "no price given".
+        price = np.where(np.isfinite(high), high, np.where(low > 0, low, np.nan))
+        bins = np.clip(np.searchsorted(self.price_bins, price, side='right'), 1, len(self.price_bins))
+        codes['price'] = np.where(np.isnan(price), 0, bins)
+
+        for name, column in codes.items():
+            self.codes[name][start:end] = column
+        self.low[start:end], self.high[start:end] = low, high
+
+        positions = np.arange(start, end)
+        for dimension in BITMAP_DIMENSIONS:
+            column = codes[dimension]
+            for code in np.unique(column).tolist():
+                bitmap = self.bitmaps[dimension].get(code)
+                if bitmap is None:
+                    bitmap = self.bitmaps[dimension][code] = np.zeros(self.capacity // 8, dtype=np.uint8)
+                hits = positions[column == code]
+                np.bitwise_or.at(bitmap, hits >> 3, (0x80 >> (hits & 7)).astype(np.uint8))
+
+        self.size = end
+        self.last_pk = rows[-1][0]
+        self.snapshot = FacetSnapshot(self)
+
+    def load_new(self, chunk_size):
+        """
+        Appends every inquiry above ``last_pk``; returns how many.
+        """
+        added = 0
+        while True:
+            rows = list(
+                Inquiry.objects.filter(pk__gt=self.last_pk).order_by('pk')
+                .values_list(*COLUMNS)[:chunk_size]
+            )
+            if not rows:
+                return added
+            self.append(rows)
+            added += len(rows)
+
+
+class FacetCache:
+    """
+    Owns the process's index and the thread that refreshes it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+        self._thread = None
+
+    def get(self):
+        """
+        Returns the latest snapshot, or None while the refresh thread is
+        still building the first index. Never touches the database.
+        """
+        # Threads do not survive a fork, so a worker forked from a preloaded
+        # master starts its own.
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(
+                        target=self._run, name='facet-refresh', daemon=True
+                    )
+                    self._thread.start()
+        index = self._index
+        return None if index is None else index.snapshot
+
+    def prime(self):
+        """
+        Builds the index in the calling thread unless there is one already,
+        for warm-up before the worker serves. Returns the number of rows.
+        """
+        if self._index is None:
+            self._index = self._build(get_config())
+        return self._index.size
+
+    def _build(self, config):
+        index = FacetIndex(config['PRICE_BINS'])
+        index.load_new(config['CHUNK_SIZE'])
+        return index
+
+    def _run(self):
+        reloaded_at = time.monotonic()
+        while True:
+            config = get_config()
+            try:
+                if self._index is None or time.monotonic() - reloaded_at > config['FULL_RELOAD_SECONDS']:
+                    self._index = self._build(config)
+                    reloaded_at = time.monotonic()
+                else:
+                    self._index.load_new(config['CHUNK_SIZE'])
+            except Exception:
+                logger.exception("Refreshing the facet index failed")
+            finally:
+                # This thread's connection is not covered by request cleanup.
+                connections.close_all()
+            time.sleep(config['REFRESH_SECONDS'])
+
+
+facet_cache = FacetCache()
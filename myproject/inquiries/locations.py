@@ -0,0 +1,270 @@
+"""
+Resolves free-text city/area/property type values (as posted by the search
+forms) to the ids of their canonical lookup rows.
+
+Resolved ids are kept in a per-process cache keyed by the normalized
+spelling, so the common case costs no database query. Only hits are
+cached: a lookup with ``create=False`` that finds nothing must not stop a
+later ``create=True`` call from creating the row. The cache holds at most
+``MAX_CACHE_SIZE`` entries, dropping the oldest first, since the keys come
+from user input.
+
+Every process checks the ``LookupVersion`` row named ``locations`` at most
+every ``VERSION_CHECK_SECONDS`` and empties its cache when the version has
+moved. Editing or deleting an alias, or merging lookups, bumps it, so
+the change reaches every worker within a few seconds.
+
+Unknown spellings create a new canonical row plus an alias. Admins fold
+variants together with ``merge``, which also moves the inquiries.
+"""
+import time
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import (
+    Area, AreaAlias, City, CityAlias, Inquiry, LookupVersion, PropertyType, PropertyTypeAlias,
+)
+from .text import normalize_text
+
+MAX_CACHE_SIZE = 10000
+
+VERSION_NAME = 'locations'
+VERSION_CHECK_SECONDS = 2
+
+_cache = {}
+_version = {'value': None, 'checked_at': float('-inf')}
+
+
+def _current_version():
+    return (
+        LookupVersion.objects.filter(name=VERSION_NAME)
+        .values_list('version', flat=True).first() or 0
+    )
+
+
+def _check_version():
+    now = time.monotonic()
+    if now - _version['checked_at'] < VERSION_CHECK_SECONDS:
+        return
+    version = _current_version()
+    if version != _version['value']:
+        _cache.clear()
+        _version['value'] = version
+    _version['checked_at'] = now
+
+
+def bump_version():
+    """
+    Invalidates the cache of every process. Call inside the transaction
+    that changes the aliases so both commit together.
+    """
+    if not LookupVersion.objects.filter(name=VERSION_NAME).update(version=F('version') + 1):
+        LookupVersion.objects.get_or_create(name=VERSION_NAME, defaults={'version': 1})
+    clear_cache()
+
+
+def _remember(cache_key, target_id):
+    if cache_key not in _cache and len(_cache) >= MAX_CACHE_SIZE:
+        # Dicts keep insertion order, so this drops the oldest entry.
+        del _cache[next(iter(_cache))]
+    _cache[cache_key] = target_id
+
+
+def _resolve(cache_key, lookup, create):
+    _check_version()
+    if cache_key in _cache:
+        return _cache[cache_key]
+    target_id = lookup()
+    if target_id is None and create is not None:
+        try:
+            with transaction.atomic():
+                target_id = create()
+        except IntegrityError:
+            # Another request created the same alias concurrently.
+            target_id = lookup()
+    if target_id is not None:
+        _remember(cache_key, target_id)
+    return target_id
+
+
+def resolve_city(raw, create=True):
+    """
+    Returns the City id for ``raw`` or None when it is blank. Unknown
+    spellings create a new city unless ``create`` is False.
+    """
+    key = normalize_text(raw)
+    if not key:
+        return None
+
+    def lookup():
+        return CityAlias.objects.filter(key=key).values_list('city_id', flat=True).first()
+
+    def create_city():
+        city, _ = City.objects.get_or_create(name=raw.strip()[:100])
+        CityAlias.objects.create(city=city, key=key)
+        return city.id
+
+    return _resolve(('city', key), lookup, create_city if create else None)
+
+
+def resolve_area(raw, city_id=None, create=True):
+    """
+    Returns the Area id for ``raw`` within ``city_id`` or None when blank.
+    """
+    key = normalize_text(raw)
+    if not key:
+        return None
+
+    def lookup():
+        return (
+            AreaAlias.objects.filter(city_id=city_id, key=key)
+            .values_list('area_id', flat=True).first()
+        )
+
+    def create_area():
+        area, _ = Area.objects.get_or_create(city_id=city_id, name=raw.strip()[:100])
+        AreaAlias.objects.create(area=area, city_id=city_id, key=key)
+        return area.id
+
+    return _resolve(('area', city_id, key), lookup, create_area if create else None)
+
+
+def resolve_property_type(raw, create=True):
+    """
+    Returns the PropertyType id for ``raw`` or None when it is blank.
+    """
+    key = normalize_text(raw)
+    if not key:
+        return None
+
+    def lookup():
+        return (
+            PropertyTypeAlias.objects.filter(key=key)
+            .values_list('property_type_id', flat=True).first()
+        )
+
+    def create_property_type():
+        property_type, _ = PropertyType.objects.get_or_create(name=raw.strip()[:50])
+        PropertyTypeAlias.objects.create(property_type=property_type, key=key)
+        return property_type.id
+
+    return _resolve(('property_type', key), lookup, create_property_type if create else None)
+
+
+def preload():
+    """
+    Fills the cache with every known alias. The lookup tables are small, so
+    this is a handful of rows and saves the first requests a query each.
+    """
+    entries = {}
+    for key, city_id in CityAlias.objects.values_list('key', 'city_id'):
+        entries[('city', key)] = city_id
+    for city_id, key, area_id in AreaAlias.objects.values_list('city_id', 'key', 'area_id'):
+        entries[('area', city_id, key)] = area_id
+    for key, property_type_id in PropertyTypeAlias.objects.values_list('key', 'property_type_id'):
+        entries[('property_type', key)] = property_type_id
+    for cache_key, target_id in entries.items():
+        _remember(cache_key, target_id)
+    return len(entries)
+
+
+def clear_cache():
+    _cache.clear()
+    # The next lookup re-reads the version before trusting the cache again.
+    _version['value'] = None
+    _version['checked_at'] = float('-inf')
+
+
+def _merge_areas(target, duplicates):
+    """
+    Moves the inquiries and aliases of ``duplicates`` to ``target`` and
+    deletes them. Areas of different cities cannot be merged.
+    """
+    ids = [area.pk for area in duplicates]
+    if any(area.city_id != target.city_id for area in duplicates):
+        raise ValueError("Only areas of the same city can be merged.")
+    moved = Inquiry.objects.filter(area_id__in=ids).update(area=target)
+    AreaAlias.objects.filter(area_id__in=ids).update(area=target)
+    Area.objects.filter(pk__in=ids).delete()
+    return moved
+
+
+def _merge_cities(target, duplicates):
+    ids = [city.pk for city in duplicates]
+    moved = Inquiry.objects.filter(city_id__in=ids).update(city=target)
+    CityAlias.objects.filter(city_id__in=ids).update(city=target)
+
+    # Areas follow their city; one already present in the target by name
+    # absorbs the moving one.
+    existing = {area.name: area for area in Area.objects.filter(city=target)}
+    for area in Area.objects.filter(city_id__in=ids):
+        if area.name in existing:
+            area.city_id = target.pk
+            _merge_areas(existing[area.name], [area])
+        else:
+            area.city = target
+            area.save(update_fields=['city'])
+            existing[area.name] = area
+    # Aliases are unique per city; the target's own spelling wins.
+    taken = set(AreaAlias.objects.filter(city=target).values_list('key', flat=True))
+    for alias in AreaAlias.objects.filter(city_id__in=ids):
+        if alias.key in taken:
+            alias.delete()
+        else:
+            AreaAlias.objects.filter(pk=alias.pk).update(city=target)
+            taken.add(alias.key)
+    City.objects.filter(pk__in=ids).delete()
+    return moved
+
+
+def _merge_property_types(target, duplicates):
+    ids = [property_type.pk for property_type in duplicates]
+    moved = Inquiry.objects.filter(property_type_id__in=ids).update(property_type=target)
+    PropertyTypeAlias.objects.filter(property_type_id__in=ids).update(property_type=target)
+    PropertyType.objects.filter(pk__in=ids).delete()
+    return moved
+
+
+_MERGERS = {
+    City: (_merge_cities, 'city_id'),
+    Area: (_merge_areas, 'area_id'),
+    PropertyType: (_merge_property_types, 'property_type_id'),
+}
+
+
+def merge(target, duplicates):
+    """
+    Folds ``duplicates`` (cities, areas or property types) into ``target``:
+    their inquiries and aliases move to it and the duplicates are deleted.
+    Returns how many inquiries were moved. Raises ValueError for a merge
+    that cannot be done.
+    """
+    duplicates = [row for row in duplicates if row.pk != target.pk]
+    if not duplicates:
+        return 0
+    if any(type(row) is not type(target) for row in duplicates):
+        raise ValueError("Only rows of the same kind can be merged.")
+    from .tasks import reindex_lookup
+
+    merger, field = _MERGERS[type(target)]
+    with transaction.atomic():
+        moved = merger(target, duplicates)
+        bump_version()
+        # Search documents are built from the aliases, which just moved; every
+        # inquiry they concern now points at the target.
+        transaction.on_commit(lambda: reindex_lookup.delay(field, target.pk))
+    return moved
+
+
+@receiver([post_save, post_delete], sender=CityAlias)
+@receiver([post_save, post_delete], sender=AreaAlias)
+@receiver([post_save, post_delete], sender=PropertyTypeAlias)
+def _invalidate_on_alias_change(sender, created=False, raw=False, **kwargs):
+    # A new alias only adds a spelling that no cache can hold yet (misses
+    # are not cached), so only edits and deletions invalidate.
+    if created or raw:
+        return
+    bump_version()
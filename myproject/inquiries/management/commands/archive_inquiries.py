@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from inquiries.archive import ArchiveLocked, archive_before, archive_dir
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves inquiries older than --older-than-days from the Inquiry table "
+        "into compressed monthly archive files."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=365)
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report how many inquiries would be archived.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['older_than_days'])
+        try:
+            moved = archive_before(cutoff, options['chunk_size'], dry_run=options['dry_run'])
+        except ArchiveLocked as exc:
+            raise CommandError(exc)
+        verb = "Would archive" if options['dry_run'] else "Archived"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {moved} inquiries created before {cutoff:%Y-%m-%d %H:%M} into {archive_dir()}."
+        ))
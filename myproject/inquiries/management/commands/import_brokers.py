@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from inquiries.brokerimport import REQUIRED_COLUMNS, import_brokers
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates broker profiles from a CSV file, with license images taken "
+        "from a ZIP file. Columns: " + ', '.join(REQUIRED_COLUMNS) + ", license_image (optional)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file')
+        parser.add_argument('--images', help="ZIP file holding the license images named in the CSV.")
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Password hashing processes (default: one per CPU).")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only validate the rows and report what would be created.")
+
+    def handle(self, *args, **options):
+        result = import_brokers(
+            options['csv_file'],
+            options['images'],
+            chunk_size=options['chunk_size'],
+            workers=options['workers'],
+            dry_run=options['dry_run'],
+        )
+        for line, message in result.errors:
+            self.stderr.write(f"Line {line}: {message}")
+        verb = "Would create" if options['dry_run'] else "Created"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {result.created} brokers; skipped {len(result.errors)} rows."
+        ))
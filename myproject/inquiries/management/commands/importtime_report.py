@@ -0,0 +1,86 @@
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# What a worker imports before it can serve: app loading plus the URLconf,
+# which pulls in every view module. -X importtime only reports imports made
+# through __import__, so importlib.import_module (which Django uses for
+# apps, models, admin and URLconfs) is routed through it first.
+STARTUP_SCRIPT = """
+import importlib, importlib.util, sys
+def import_module(name, package=None):
+    if name.startswith('.'):
+        name = importlib.util.resolve_name(name, package)
+    __import__(name)
+    return sys.modules[name]
+importlib.import_module = import_module
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+"""
+
+
+def parse_importtime(output):
+    """
+    Parses ``-X importtime`` lines into {module: (self_us, cumulative_us)}.
+    """
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+class Command(BaseCommand):
+    help = (
+        "Starts a fresh interpreter with -X importtime, loads the project the "
+        "way a worker does and breaks the import cost down per app module."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20, help="Rows per section.")
+
+    def handle(self, *args, **options):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT],
+            capture_output=True, text=True, env=os.environ.copy(),
+            cwd=settings.BASE_DIR,
+        )
+        if result.returncode != 0:
+            raise CommandError(result.stderr.strip().splitlines()[-1])
+        modules = parse_importtime(result.stderr)
+        limit = options['limit']
+
+        packages = {}
+        for name, (self_us, _) in modules.items():
+            top = name.split('.')[0]
+            packages[top] = packages.get(top, 0) + self_us
+        total = sum(packages.values())
+        self.stdout.write(f"Total import time: {total / 1000:.1f} ms\n")
+
+        self.stdout.write("Top-level packages (self time):")
+        for top, self_us in sorted(packages.items(), key=lambda item: -item[1])[:limit]:
+            self.stdout.write(f"  {self_us / 1000:8.1f} ms  {top}")
+
+        app_prefixes = tuple(
+            config.name for config in self._project_apps()
+        ) + (settings.ROOT_URLCONF.split('.')[0],)
+        self.stdout.write("\nProject modules (self / cumulative):")
+        app_modules = [
+            (name, timing) for name, timing in modules.items()
+            if name.split('.')[0] in app_prefixes
+        ]
+        for name, (self_us, cumulative_us) in sorted(app_modules, key=lambda item: -item[1][1])[:limit]:
+            self.stdout.write(f"  {self_us / 1000:8.1f} / {cumulative_us / 1000:8.1f} ms  {name}")
+
+    def _project_apps(self):
+        from django.apps import apps
+
+        base_dir = str(settings.BASE_DIR)
+        return [config for config in apps.get_app_configs() if config.path.startswith(base_dir)]
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from inquiries.scoring import refresh_leads
+
+
+class Command(BaseCommand):
+    help = "Recomputes the stored broker lead rankings. Can run from cron instead of the run_tasks worker."
+
+    def handle(self, *args, **options):
+        leads = refresh_leads()
+        self.stdout.write(self.style.SUCCESS(f"Ranked leads for {len(leads)} places."))
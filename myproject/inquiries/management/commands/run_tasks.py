@@ -0,0 +1,75 @@
+import os
+import signal
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections
+from django.utils.module_loading import autodiscover_modules
+
+from inquiries import taskqueue
+
+
+class Command(BaseCommand):
+    help = "Runs queued background tasks until stopped (SIGINT/SIGTERM finish the current batch)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10)
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds to sleep when the queue is empty.")
+        parser.add_argument('--stale-after', type=int, default=600,
+                            help="Requeue tasks whose worker sent no heartbeat for this many seconds.")
+        parser.add_argument('--purge-after', type=int, default=7 * 24 * 3600,
+                            help="Delete done tasks finished longer ago than this many seconds.")
+        parser.add_argument('--once', action='store_true',
+                            help="Drain the due tasks once and exit.")
+        parser.add_argument('--stats', action='store_true',
+                            help="Print queue statistics and exit.")
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            stats = taskqueue.queue_stats()
+            for status, count in stats['counts'].items():
+                self.stdout.write(f"{status:<8} {count}")
+            self.stdout.write(f"oldest due task waited {stats['oldest_due_seconds']:.1f} s")
+            return
+
+        autodiscover_modules('tasks')
+        worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        metrics = taskqueue.WorkerMetrics()
+        self._stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        self.stdout.write(f"Worker {worker_id} started with {len(taskqueue.registry)} registered tasks.")
+
+        last_maintenance = 0.0
+        while not self._stopping:
+            close_old_connections()
+            try:
+                if time.monotonic() - last_maintenance > 60:
+                    taskqueue.requeue_stale(options['stale_after'])
+                    taskqueue.purge_finished(options['purge_after'])
+                    last_maintenance = time.monotonic()
+
+                batch = taskqueue.claim(worker_id, options['batch_size'])
+                for background_task in batch:
+                    started = time.perf_counter()
+                    status = taskqueue.execute(background_task)
+                    metrics.record(background_task.name, status, time.perf_counter() - started)
+            except OperationalError as exc:
+                # Typically "database is locked" past the busy timeout. A task
+                # claimed but not reported back is requeued by requeue_stale.
+                self.stderr.write(f"Database unavailable, retrying: {exc}")
+                time.sleep(options['poll_interval'])
+                continue
+
+            if not batch:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+
+        for line in metrics.summary():
+            self.stdout.write(line)
+
+    def _stop(self, signum, frame):
+        self._stopping = True
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from inquiries.warmup import warm_up
+
+
+class Command(BaseCommand):
+    help = "Runs the worker warm-up steps and reports how long each took."
+
+    def handle(self, *args, **options):
+        for name, (count, seconds) in warm_up().items():
+            self.stdout.write(f"{name:<12} {count:>6}  {seconds * 1000:8.1f} ms")
@@ -0,0 +1,111 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inquiries', '0002_paymentlog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='City',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Cities',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PropertyType',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Area',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('city', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='areas', to='inquiries.city')),
+            ],
+            options={
+                'ordering': ['name'],
+                'constraints': [models.UniqueConstraint(fields=('city', 'name'), name='unique_area_per_city')],
+            },
+        ),
+        migrations.CreateModel(
+            name='CityAlias',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=150, unique=True)),
+                ('city', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='aliases', to='inquiries.city')),
+            ],
+            options={
+                'verbose_name_plural': 'City aliases',
+            },
+        ),
+        migrations.CreateModel(
+            name='AreaAlias',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=150)),
+                ('area', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='aliases', to='inquiries.area')),
+                ('city', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='inquiries.city')),
+            ],
+            options={
+                'verbose_name_plural': 'Area aliases',
+                'constraints': [models.UniqueConstraint(fields=('city', 'key'), name='unique_area_alias_per_city')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PropertyTypeAlias',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=150, unique=True)),
+                ('property_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='aliases', to='inquiries.propertytype')),
+            ],
+            options={
+                'verbose_name_plural': 'Property type aliases',
+            },
+        ),
+        # Keep the free-text columns around until 0004 has copied them over.
+        migrations.RenameField(
+            model_name='inquiry',
+            old_name='city',
+            new_name='legacy_city',
+        ),
+        migrations.RenameField(
+            model_name='inquiry',
+            old_name='area',
+            new_name='legacy_area',
+        ),
+        migrations.RenameField(
+            model_name='inquiry',
+            old_name='property_type',
+            new_name='legacy_property_type',
+        ),
+        migrations.AddField(
+            model_name='inquiry',
+            name='city',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='inquiries', to='inquiries.city'),
+        ),
+        migrations.AddField(
+            model_name='inquiry',
+            name='area',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='inquiries', to='inquiries.area'),
+        ),
+        migrations.AddField(
+            model_name='inquiry',
+            name='property_type',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='inquiries', to='inquiries.propertytype'),
+        ),
+    ]
@@ -0,0 +1,133 @@
+import re
+import unicodedata
+
+from django.db import migrations
+
+CHUNK_SIZE = 2000
+
+# A frozen copy of inquiries.text.normalize_text as it was when this
+# migration was written, so later changes to it cannot alter the backfill.
+_ARABIC_MARKS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+_ALEF_VARIANTS = str.maketrans({
+    '\u0622': '\u0627',
+    '\u0623': '\u0627',
+    '\u0625': '\u0627',
+    '\u0671': '\u0627',
+    '\u0649': '\u064a',
+    '\u0629': '\u0647',
+    '\u0624': '\u0648',
+    '\u0626': '\u064a',
+})
+_NON_WORD = re.compile(r'[^\w]+')
+
+
+def normalize_text(value):
+    if not value:
+        return ''
+    value = unicodedata.normalize('NFKC', str(value))
+    value = _ARABIC_MARKS.sub('', value)
+    value = value.translate(_ALEF_VARIANTS)
+    value = _NON_WORD.sub(' ', value.casefold()).replace('_', ' ')
+    return ' '.join(value.split())
+
+
+def backfill_locations(apps, schema_editor):
+    """
+    Maps the legacy free-text columns onto lookup rows, walking the table
+    in primary-key chunks and issuing one UPDATE per distinct id triple.
+    """
+    Inquiry = apps.get_model('inquiries', 'Inquiry')
+    City = apps.get_model('inquiries', 'City')
+    CityAlias = apps.get_model('inquiries', 'CityAlias')
+    Area = apps.get_model('inquiries', 'Area')
+    AreaAlias = apps.get_model('inquiries', 'AreaAlias')
+    PropertyType = apps.get_model('inquiries', 'PropertyType')
+    PropertyTypeAlias = apps.get_model('inquiries', 'PropertyTypeAlias')
+
+    cities, areas, property_types = {}, {}, {}
+
+    def city_id(raw):
+        key = normalize_text(raw)
+        if not key:
+            return None
+        if key not in cities:
+            alias = CityAlias.objects.filter(key=key).first()
+            if alias is None:
+                city, _ = City.objects.get_or_create(name=raw.strip()[:100])
+                alias = CityAlias.objects.create(city=city, key=key)
+            cities[key] = alias.city_id
+        return cities[key]
+
+    def area_id(raw, parent_id):
+        key = normalize_text(raw)
+        if not key:
+            return None
+        if (parent_id, key) not in areas:
+            alias = AreaAlias.objects.filter(city_id=parent_id, key=key).first()
+            if alias is None:
+                area, _ = Area.objects.get_or_create(city_id=parent_id, name=raw.strip()[:100])
+                alias = AreaAlias.objects.create(area=area, city_id=parent_id, key=key)
+            areas[(parent_id, key)] = alias.area_id
+        return areas[(parent_id, key)]
+
+    def property_type_id(raw):
+        key = normalize_text(raw)
+        if not key:
+            return None
+        if key not in property_types:
+            alias = PropertyTypeAlias.objects.filter(key=key).first()
+            if alias is None:
+                property_type, _ = PropertyType.objects.get_or_create(name=raw.strip()[:50])
+                alias = PropertyTypeAlias.objects.create(property_type=property_type, key=key)
+            property_types[key] = alias.property_type_id
+        return property_types[key]
+
+    last_pk = 0
+    while True:
+        rows = list(
+            Inquiry.objects.filter(pk__gt=last_pk)
+            .order_by('pk')
+            .values_list('pk', 'legacy_city', 'legacy_area', 'legacy_property_type')[:CHUNK_SIZE]
+        )
+        if not rows:
+            break
+        groups = {}
+        for pk, city, area, property_type in rows:
+            c = city_id(city)
+            ids = (c, area_id(area, c), property_type_id(property_type))
+            groups.setdefault(ids, []).append(pk)
+        for (c, a, p), pks in groups.items():
+            if c is None and a is None and p is None:
+                continue
+            Inquiry.objects.filter(pk__in=pks).update(city_id=c, area_id=a, property_type_id=p)
+        last_pk = rows[-1][0]
+
+
+def restore_legacy_text(apps, schema_editor):
+    Inquiry = apps.get_model('inquiries', 'Inquiry')
+    last_pk = 0
+    while True:
+        rows = list(
+            Inquiry.objects.filter(pk__gt=last_pk)
+            .order_by('pk')
+            .select_related('city', 'area', 'property_type')[:CHUNK_SIZE]
+        )
+        if not rows:
+            break
+        for inquiry in rows:
+            inquiry.legacy_city = inquiry.city.name if inquiry.city else ''
+            inquiry.legacy_area = inquiry.area.name if inquiry.area else ''
+            inquiry.legacy_property_type = inquiry.property_type.name if inquiry.property_type else ''
+        Inquiry.objects.bulk_update(rows, ['legacy_city', 'legacy_area', 'legacy_property_type'])
+        last_pk = rows[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inquiries', '0003_location_lookups'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_locations, restore_legacy_text),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inquiries', '0004_backfill_locations'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='inquiry',
+            name='legacy_city',
+        ),
+        migrations.RemoveField(
+            model_name='inquiry',
+            name='legacy_area',
+        ),
+        migrations.RemoveField(
+            model_name='inquiry',
+            name='legacy_property_type',
+        ),
+    ]
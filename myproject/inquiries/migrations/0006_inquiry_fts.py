@@ -0,0 +1,80 @@
+from django.db import migrations
+
+# Frozen here rather than imported from inquiries.search, so the migration
+# keeps building the index it was written for.
+FTS_TABLE = 'inquiries_inquiry_fts'
+CHUNK_SIZE = 2000
+
+
+def fill_search_index(apps, schema_editor):
+    """
+    Writes one document per inquiry from the alias keys of its city, area
+    and property type, like inquiries.search.build_document.
+    """
+    def alias_keys(model_name, target):
+        keys = {}
+        model = apps.get_model('inquiries', model_name)
+        for target_id, key in model.objects.values_list(target, 'key').iterator():
+            keys.setdefault(target_id, []).append(key)
+        return keys
+
+    cities = alias_keys('CityAlias', 'city_id')
+    areas = alias_keys('AreaAlias', 'area_id')
+    property_types = alias_keys('PropertyTypeAlias', 'property_type_id')
+    Inquiry = apps.get_model('inquiries', 'Inquiry')
+    if schema_editor.connection.vendor == 'sqlite':
+        insert = f'INSERT INTO {FTS_TABLE} (rowid, document) VALUES (%s, %s)'
+    else:
+        insert = f'INSERT INTO {FTS_TABLE} (inquiry_id, document) VALUES (%s, %s)'
+
+    last_pk = 0
+    while True:
+        rows = list(
+            Inquiry.objects.filter(pk__gt=last_pk).order_by('pk')
+            .values_list('pk', 'city_id', 'area_id', 'property_type_id')[:CHUNK_SIZE]
+        )
+        if not rows:
+            break
+        params = []
+        for pk, city_id, area_id, property_type_id in rows:
+            parts = cities.get(city_id, []) + areas.get(area_id, []) + property_types.get(property_type_id, [])
+            params.append([pk, ' '.join(dict.fromkeys(' '.join(parts).split()))])
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany(insert, params)
+        last_pk = rows[-1][0]
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+            f"document, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            f"CREATE TABLE {FTS_TABLE} ("
+            f"inquiry_id bigint PRIMARY KEY REFERENCES inquiries_inquiry (id) ON DELETE CASCADE, "
+            f"document text NOT NULL, "
+            f"vector tsvector GENERATED ALWAYS AS (to_tsvector('simple', document)) STORED)"
+        )
+        schema_editor.execute(f'CREATE INDEX {FTS_TABLE}_vector ON {FTS_TABLE} USING gin (vector)')
+    else:
+        return
+    fill_search_index(apps, schema_editor)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inquiries', '0005_remove_legacy_location_text'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.2 on 2026-10-19 16:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inquiries', '0007_backgroundtask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InquiryArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='First day of the archived month.', unique=True)),
+                ('path', models.CharField(help_text='File name inside INQUIRY_ARCHIVE_DIR.', max_length=255)),
+                ('rows', models.PositiveIntegerField(default=0)),
+                ('archived_until', models.DateTimeField(help_text='Cutoff of the latest run: no hot inquiry in this month is older than this.')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Inquiry Archive',
+                'verbose_name_plural': 'Inquiry Archives',
+                'ordering': ['-month'],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.2 on 2026-10-19 17:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inquiries', '0008_inquiryarchive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeadRanking',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('city_id', models.BigIntegerField()),
+                ('area_id', models.BigIntegerField(blank=True, null=True)),
+                ('inquiry_id', models.BigIntegerField()),
+                ('rank', models.PositiveIntegerField()),
+                ('score', models.FloatField()),
+                ('computed_at', models.DateTimeField()),
+            ],
+            options={
+                'ordering': ['city_id', 'area_id', 'rank'],
+                'indexes': [models.Index(fields=['city_id', 'area_id', 'rank'], name='inquiries_lead_rank_idx')],
+            },
+        ),
+    ]
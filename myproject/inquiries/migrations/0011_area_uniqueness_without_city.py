@@ -0,0 +1,63 @@
+# Generated by Django 5.2.2 on 2026-10-19 17:24
+
+from django.db import migrations, models
+
+
+def merge_duplicates_without_city(apps, schema_editor):
+    """
+    The old constraints let areas and aliases without a city repeat. Keeps
+    the oldest of each and moves inquiries and aliases onto it.
+    """
+    Inquiry = apps.get_model('inquiries', 'Inquiry')
+    Area = apps.get_model('inquiries', 'Area')
+    AreaAlias = apps.get_model('inquiries', 'AreaAlias')
+
+    kept = {}
+    for pk, name in Area.objects.filter(city__isnull=True).order_by('pk').values_list('pk', 'name'):
+        if name not in kept:
+            kept[name] = pk
+            continue
+        Inquiry.objects.filter(area_id=pk).update(area_id=kept[name])
+        AreaAlias.objects.filter(area_id=pk).update(area_id=kept[name])
+        Area.objects.filter(pk=pk).delete()
+
+    seen = set()
+    for pk, key in AreaAlias.objects.filter(city__isnull=True).order_by('pk').values_list('pk', 'key'):
+        if key in seen:
+            AreaAlias.objects.filter(pk=pk).delete()
+        seen.add(key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inquiries', '0010_lookupversion'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates_without_city, migrations.RunPython.noop),
+        migrations.RemoveConstraint(
+            model_name='area',
+            name='unique_area_per_city',
+        ),
+        migrations.RemoveConstraint(
+            model_name='areaalias',
+            name='unique_area_alias_per_city',
+        ),
+        migrations.AddConstraint(
+            model_name='area',
+            constraint=models.UniqueConstraint(condition=models.Q(('city__isnull', False)), fields=('city', 'name'), name='unique_area_per_city'),
+        ),
+        migrations.AddConstraint(
+            model_name='area',
+            constraint=models.UniqueConstraint(condition=models.Q(('city__isnull', True)), fields=('name',), name='unique_area_without_city'),
+        ),
+        migrations.AddConstraint(
+            model_name='areaalias',
+            constraint=models.UniqueConstraint(condition=models.Q(('city__isnull', False)), fields=('city', 'key'), name='unique_area_alias_per_city'),
+        ),
+        migrations.AddConstraint(
+            model_name='areaalias',
+            constraint=models.UniqueConstraint(condition=models.Q(('city__isnull', True)), fields=('key',), name='unique_area_alias_without_city'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.2 on 2026-10-19 17:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inquiries', '0011_area_uniqueness_without_city'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='inquiry',
+            index=models.Index(fields=['city', 'created_at'], name='inquiries_city_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inquiry',
+            index=models.Index(fields=['area', 'created_at'], name='inquiries_area_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inquiry',
+            index=models.Index(fields=['property_type', 'created_at'], name='inquiries_type_created_idx'),
+        ),
+    ]
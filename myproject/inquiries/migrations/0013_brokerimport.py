@@ -0,0 +1,32 @@
+# Generated by Django 5.2.2 on 2026-10-19 17:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inquiries', '0012_inquiry_lookup_created_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BrokerImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('csv_file', models.FileField(upload_to='imports/', verbose_name='CSV file')),
+                ('images', models.FileField(blank=True, upload_to='imports/', verbose_name='License images (ZIP)')),
+                ('dry_run', models.BooleanField(default=False, help_text='Only validate the rows.')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('created', models.PositiveIntegerField(default=0, help_text='Brokers created, or that would be created on a dry run.')),
+                ('errors', models.JSONField(blank=True, default=list, help_text='Skipped rows as [line, reason].')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Broker Import',
+                'verbose_name_plural': 'Broker Imports',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+import importlib
+
+from django.db import migrations
+
+# The normalizer frozen in 0004, so this migration keeps meaning what it
+# did when it was written.
+normalize_text = importlib.import_module('inquiries.migrations.0004_backfill_locations').normalize_text
+
+
+def normalize_alias_keys(apps, schema_editor):
+    """
+    Aliases added in the admin were stored as typed and never matched a
+    lookup. Normalizes their keys; one that then repeats an existing alias
+    of the same scope is dropped, and one that normalizes to nothing too.
+    """
+    for model_name, scope in (('CityAlias', None), ('AreaAlias', 'city_id'), ('PropertyTypeAlias', None)):
+        model = apps.get_model('inquiries', model_name)
+        fields = ['pk', 'key'] + ([scope] if scope else [])
+        taken = set()
+        rows = list(model.objects.order_by('pk').values_list(*fields))
+        # Keys already normalized win over ones that become equal to them.
+        rows.sort(key=lambda row: row[1] != normalize_text(row[1]))
+        for row in rows:
+            pk, key = row[0], row[1]
+            normalized = normalize_text(key)
+            identity = (row[2] if scope else None, normalized)
+            if not normalized or identity in taken:
+                model.objects.filter(pk=pk).delete()
+                continue
+            taken.add(identity)
+            if normalized != key:
+                model.objects.filter(pk=pk).update(key=normalized)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inquiries', '0013_brokerimport'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_alias_keys, migrations.RunPython.noop),
+    ]
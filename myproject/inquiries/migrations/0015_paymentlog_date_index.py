@@ -0,0 +1,17 @@
+# Generated by Django 5.2.2 on 2026-10-19 17:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inquiries', '0014_normalize_alias_keys'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='paymentlog',
+            index=models.Index(fields=['payment_date', 'id'], name='inquiries_payment_date_idx'),
+        ),
+    ]
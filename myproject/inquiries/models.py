@@ -1,7 +1,11 @@
 from django.db import models
+from django.db.models import Q
 from django.contrib.auth.hashers import make_password, check_password
+from django.core.exceptions import ValidationError
 from django.utils import timezone
 
+from .text import normalize_text
+
 class UserProfile(models.Model):
     """
     Stores both end-users and brokers.
@@ -89,6 +93,158 @@ class BrokerProfile(UserProfile):
         verbose_name_plural = 'Brokers'
 
 
+class City(models.Model):
+    """
+    Canonical city names referenced by inquiries.
+    """
+    name = models.CharField(max_length=100, unique=True)
+
+    class Meta:
+        ordering = ['name']
+        verbose_name_plural = 'Cities'
+
+    def __str__(self):
+        return self.name
+
+
+class Area(models.Model):
+    """
+    Canonical area names, scoped to the city they belong to.
+    """
+    city = models.ForeignKey(
+        City, on_delete=models.CASCADE, null=True, blank=True, related_name='areas'
+    )
+    name = models.CharField(max_length=100)
+
+    class Meta:
+        ordering = ['name']
+        # NULLs never compare equal in a unique index, so areas without a
+        # city get a constraint of their own.
+        constraints = [
+            models.UniqueConstraint(
+                fields=['city', 'name'], condition=Q(city__isnull=False), name='unique_area_per_city',
+            ),
+            models.UniqueConstraint(
+                fields=['name'], condition=Q(city__isnull=True), name='unique_area_without_city',
+            ),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class PropertyType(models.Model):
+    """
+    Canonical property types (apartment, villa, ...).
+    """
+    name = models.CharField(max_length=50, unique=True)
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+
+class NormalizedKeyMixin:
+    """
+    Stores alias keys the way lookups compute them (see
+    inquiries.text.normalize_text), so an alias typed into the admin as
+    "El Qahira" matches the spelling "el qahira" posted by a form.
+    """
+
+    def clean(self):
+        super().clean()
+        self.key = normalize_text(self.key)
+        if not self.key:
+            raise ValidationError({'key': "The key must contain letters or digits."})
+
+    def save(self, *args, **kwargs):
+        self.key = normalize_text(self.key)
+        super().save(*args, **kwargs)
+
+
+class CityAlias(NormalizedKeyMixin, models.Model):
+    """
+    Maps a normalized spelling (see inquiries.text.normalize_text) to a city,
+    so Arabic and English variants of the same place share one row.
+    """
+    city = models.ForeignKey(City, on_delete=models.CASCADE, related_name='aliases')
+    key  = models.CharField(max_length=150, unique=True)
+
+    class Meta:
+        verbose_name_plural = 'City aliases'
+
+    def __str__(self):
+        return f"{self.key} -> {self.city}"
+
+
+class AreaAlias(NormalizedKeyMixin, models.Model):
+    """
+    Maps a normalized spelling to an area within a city. ``city`` repeats
+    the area's city so lookups by (city, key) need no join; it is taken
+    from the area when left blank.
+    """
+    area = models.ForeignKey(Area, on_delete=models.CASCADE, related_name='aliases')
+    city = models.ForeignKey(City, on_delete=models.CASCADE, null=True, blank=True)
+    key  = models.CharField(max_length=150)
+
+    class Meta:
+        verbose_name_plural = 'Area aliases'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['city', 'key'], condition=Q(city__isnull=False), name='unique_area_alias_per_city',
+            ),
+            models.UniqueConstraint(
+                fields=['key'], condition=Q(city__isnull=True), name='unique_area_alias_without_city',
+            ),
+        ]
+
+    def clean(self):
+        super().clean()
+        if self.area_id is None:
+            return
+        if self.city_id is None:
+            self.city_id = self.area.city_id
+        elif self.city_id != self.area.city_id:
+            raise ValidationError({'city': "Must be the city of the area."})
+
+    def save(self, *args, **kwargs):
+        if self.city_id is None and self.area_id is not None:
+            self.city_id = self.area.city_id
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.key} -> {self.area}"
+
+
+class PropertyTypeAlias(NormalizedKeyMixin, models.Model):
+    """
+    Maps a normalized spelling to a property type.
+    """
+    property_type = models.ForeignKey(PropertyType, on_delete=models.CASCADE, related_name='aliases')
+    key           = models.CharField(max_length=150, unique=True)
+
+    class Meta:
+        verbose_name_plural = 'Property type aliases'
+
+    def __str__(self):
+        return f"{self.key} -> {self.property_type}"
+
+
+class LookupVersion(models.Model):
+    """
+    A counter per cached lookup table. Worker processes compare it with the
+    value they cached under and drop their cache when it has moved, so an
+    edit made in one process reaches all of them. See inquiries.locations.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+
 class Inquiry(models.Model):
     """
     Stores property-search inquiries submitted by users.
@@ -105,9 +261,15 @@ class Inquiry(models.Model):
         choices=TRANSACTION_CHOICES,
         default=TRANSACTION_RENT,
     )
-    city            = models.CharField(max_length=100, blank=True)
-    area            = models.CharField(max_length=100, blank=True)
-    property_type   = models.CharField(max_length=50, blank=True)
+    city            = models.ForeignKey(
+        City, on_delete=models.PROTECT, null=True, blank=True, related_name='inquiries'
+    )
+    area            = models.ForeignKey(
+        Area, on_delete=models.PROTECT, null=True, blank=True, related_name='inquiries'
+    )
+    property_type   = models.ForeignKey(
+        PropertyType, on_delete=models.PROTECT, null=True, blank=True, related_name='inquiries'
+    )
     bedrooms        = models.PositiveIntegerField(null=True, blank=True)
     bathrooms       = models.PositiveIntegerField(null=True, blank=True)
     min_price       = models.PositiveIntegerField(null=True, blank=True)
@@ -119,6 +281,12 @@ class Inquiry(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        # Search reads the newest inquiries of one place or type at a time.
+        indexes = [
+            models.Index(fields=['city', 'created_at'], name='inquiries_city_created_idx'),
+            models.Index(fields=['area', 'created_at'], name='inquiries_area_created_idx'),
+            models.Index(fields=['property_type', 'created_at'], name='inquiries_type_created_idx'),
+        ]
         verbose_name = 'Inquiry'
         verbose_name_plural = 'Inquiries'
 
@@ -130,7 +298,6 @@ class Inquiry(models.Model):
 
 
 from django.conf import settings
-from cryptography.fernet import Fernet
 import base64
 import hashlib
 
@@ -148,12 +315,20 @@ class PaymentInfo(models.Model):
     def __str__(self):
         return f"Payment info for {self.user.full_name}"
 
+    _cipher_suite = None
+
     @classmethod
     def _get_cipher_suite(cls):
-        # Derive a 32-byte key from SECRET_KEY
-        digest = hashlib.sha256(settings.SECRET_KEY.encode()).digest()
-        key = base64.urlsafe_b64encode(digest[:32])  # Fernet key must be 32 bytes
-        return Fernet(key)
+        # cryptography is only needed on payment paths, so it is imported
+        # here rather than at module level to keep worker start-up fast.
+        if cls._cipher_suite is None:
+            from cryptography.fernet import Fernet
+
+            # Derive a 32-byte key from SECRET_KEY
+            digest = hashlib.sha256(settings.SECRET_KEY.encode()).digest()
+            key = base64.urlsafe_b64encode(digest[:32])  # Fernet key must be 32 bytes
+            cls._cipher_suite = Fernet(key)
+        return cls._cipher_suite
 
     @classmethod
     def encrypt_value(cls, value):
@@ -254,8 +429,150 @@ class PaymentLog(models.Model):
 
     class Meta:
         ordering = ['-payment_date']
+        # Serves the admin's newest-first cursor paging; see inquiries.changelists.
+        indexes = [
+            models.Index(fields=['payment_date', 'id'], name='inquiries_payment_date_idx'),
+        ]
         verbose_name = 'Payment Log'
         verbose_name_plural = 'Payment Logs'
 
     def __str__(self):
         return f"Payment of {self.amount} by {self.broker.full_name} on {self.payment_date.strftime('%Y-%m-%d')}"
+
+
+class BackgroundTask(models.Model):
+    """
+    A unit of deferred work picked up by the ``run_tasks`` worker.
+    See inquiries.taskqueue for the producer and consumer side.
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(
+        max_length=200,
+        help_text="Registered task name, normally the function's dotted path."
+    )
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default=STATUS_QUEUED,
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_at = models.DateTimeField(
+        default=timezone.now,
+        help_text="The task is not claimed before this time."
+    )
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['run_at']
+        verbose_name = 'Background Task'
+        verbose_name_plural = 'Background Tasks'
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='inquiries_task_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.get_status_display()})"
+
+
+class InquiryArchive(models.Model):
+    """
+    Catalogue of the monthly cold-storage files written by the
+    ``archive_inquiries`` command. See inquiries.archive.
+    """
+    month = models.DateField(unique=True, help_text="First day of the archived month.")
+    path = models.CharField(max_length=255, help_text="File name inside INQUIRY_ARCHIVE_DIR.")
+    rows = models.PositiveIntegerField(default=0)
+    archived_until = models.DateTimeField(
+        help_text="Cutoff of the latest run: no hot inquiry in this month is older than this."
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-month']
+        verbose_name = 'Inquiry Archive'
+        verbose_name_plural = 'Inquiry Archives'
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} ({self.rows} inquiries)"
+
+
+class BrokerImport(models.Model):
+    """
+    An uploaded broker CSV (and optional ZIP of license images) waiting for
+    or processed by the ``import_brokers`` background task. The uploads are
+    deleted once the task has run; the outcome stays.
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    # CSV columns every row needs; see inquiries.brokerimport.
+    REQUIRED_COLUMNS = ('full_name', 'email', 'national_id', 'phone', 'password')
+
+    csv_file = models.FileField(upload_to='imports/', verbose_name='CSV file')
+    images = models.FileField(
+        upload_to='imports/', blank=True, verbose_name='License images (ZIP)'
+    )
+    dry_run = models.BooleanField(default=False, help_text="Only validate the rows.")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    created = models.PositiveIntegerField(
+        default=0, help_text="Brokers created, or that would be created on a dry run."
+    )
+    errors = models.JSONField(default=list, blank=True, help_text="Skipped rows as [line, reason].")
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Broker Import'
+        verbose_name_plural = 'Broker Imports'
+
+    def __str__(self):
+        return f"Broker import #{self.pk} ({self.status})"
+
+
+class LeadRanking(models.Model):
+    """
+    The stored broker lead rankings, one row per ranked inquiry. Written by
+    ``inquiries.scoring.refresh_leads`` and read by every web worker.
+    ``area_id`` is NULL in the city-wide ranking. The ids are plain columns
+    rather than foreign keys: the table is derived data, rebuilt as a whole
+    on every refresh, and must not block deleting or archiving inquiries.
+    """
+    city_id = models.BigIntegerField()
+    area_id = models.BigIntegerField(null=True, blank=True)
+    inquiry_id = models.BigIntegerField()
+    rank = models.PositiveIntegerField()
+    score = models.FloatField()
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['city_id', 'area_id', 'rank']
+        indexes = [
+            models.Index(fields=['city_id', 'area_id', 'rank'], name='inquiries_lead_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.rank} in {self.city_id}/{self.area_id}: inquiry {self.inquiry_id}"
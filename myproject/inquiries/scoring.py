@@ -0,0 +1,229 @@
+"""
+Lead scoring for brokers.
+
+Recent inquiries are pulled with ``values_list`` in primary-key chunks into
+NumPy arrays and scored column-wise, never as ORM instances. The best
+``LEAD_SCORING['TOP_N']`` inquiries per city and per (city, area) are stored
+in the ``LeadRanking`` table, which every worker process reads. They are
+recomputed by the ``refresh_leads`` background task once older than
+``LEAD_SCORING['REFRESH_SECONDS']``, or by the ``refresh_leads`` command.
+Requests only ever read the stored rankings; they never score.
+"""
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import Inquiry, LeadRanking
+
+DEFAULTS = {
+    'WINDOW_DAYS': 90,
+    'HALF_LIFE_DAYS': 7,
+    'TOP_N': 50,
+    'CHUNK_SIZE': 20000,
+    'REFRESH_SECONDS': 300,
+    'WEIGHTS': {
+        'budget': 0.3,
+        'specificity': 0.25,
+        'recency': 0.3,
+        'demand': 0.15,
+    },
+}
+
+COLUMNS = (
+    'pk', 'city_id', 'area_id', 'min_price', 'max_price', 'bedrooms',
+    'bathrooms', 'min_size', 'max_size', 'furnished', 'created_at',
+)
+
+
+def get_config():
+    config = {**DEFAULTS, **getattr(settings, 'LEAD_SCORING', {})}
+    config['WEIGHTS'] = {**DEFAULTS['WEIGHTS'], **config['WEIGHTS']}
+    return config
+
+
+def _to_arrays(rows):
+    """
+    Converts ``values_list`` rows into one float64 array per column, with
+    NULLs as NaN and foreign keys as int64 (0 for "not set").
+    """
+    columns = list(zip(*rows))
+    arrays = {}
+    for name, values in zip(COLUMNS, columns):
+        if name == 'created_at':
+            arrays[name] = np.fromiter((v.timestamp() for v in values), dtype=np.float64, count=len(values))
+        elif name in ('pk', 'city_id', 'area_id'):
+            arrays[name] = np.fromiter((v or 0 for v in values), dtype=np.int64, count=len(values))
+        else:
+            arrays[name] = np.array([np.nan if v is None else float(v) for v in values], dtype=np.float64)
+    return arrays
+
+
+def score_arrays(arrays, now, demand, config):
+    """
+    Scores a chunk; every component is in [0, 1] and the result is their
+    weighted sum.
+
+    ``demand`` maps packed place keys (see ``_place_keys``) to the inquiry
+    count for that place in the window, divided by the busiest place's count.
+    """
+    min_price, max_price = arrays['min_price'], arrays['max_price']
+
+    # Narrow budgets are easier to serve; an open-ended budget scores half,
+    # and a missing or inverted one (minimum above maximum) nothing.
+    width = (max_price - min_price) / np.where(max_price > 0, max_price, np.nan)
+    budget = np.where(
+        (np.isnan(min_price) & np.isnan(max_price)) | (min_price > max_price), 0.0,
+        np.where(np.isnan(width), 0.5, 1.0 - np.clip(width, 0.0, 1.0)),
+    )
+
+    specificity = np.mean([
+        ~np.isnan(arrays['bedrooms']),
+        ~np.isnan(arrays['bathrooms']),
+        ~np.isnan(arrays['min_size']) & ~np.isnan(arrays['max_size']),
+        arrays['furnished'] > 0,
+    ], axis=0)
+
+    age_days = np.maximum(now - arrays['created_at'], 0.0) / 86400.0
+    recency = np.exp2(-age_days / config['HALF_LIFE_DAYS'])
+
+    place = _place_keys(arrays['city_id'], arrays['area_id'])
+    local_demand = np.zeros(len(place))
+    if demand:
+        keys = np.fromiter(demand.keys(), dtype=np.int64, count=len(demand))
+        values = np.fromiter(demand.values(), dtype=np.float64, count=len(demand))
+        order = np.argsort(keys)
+        keys, values = keys[order], values[order]
+        idx = np.clip(np.searchsorted(keys, place), 0, len(keys) - 1)
+        local_demand = np.where(keys[idx] == place, values[idx], 0.0)
+
+    weights = config['WEIGHTS']
+    return (
+        weights['budget'] * budget
+        + weights['specificity'] * specificity
+        + weights['recency'] * recency
+        + weights['demand'] * local_demand
+    )
+
+
+def _place_keys(city_ids, area_ids):
+    # Packs (city_id, area_id) into one int64 so grouping is a single sort.
+    return (city_ids << 32) | area_ids
+
+
+def _top_n(groups, scores, pks, n):
+    """
+    Keeps the ``n`` best scores per group, sorted best first within groups.
+    """
+    order = np.lexsort((-scores, groups))
+    groups, scores, pks = groups[order], scores[order], pks[order]
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    rank = np.arange(len(groups)) - np.repeat(starts, np.diff(np.r_[starts, len(groups)]))
+    keep = rank < n
+    return groups[keep], scores[keep], pks[keep]
+
+
+def compute_leads(config=None):
+    """
+    Scores every inquiry inside the window and returns
+    ``{(city_id, area_id): [(inquiry_id, score), ...]}``, where area_id is
+    None for the city-wide ranking.
+    """
+    config = config or get_config()
+    now = timezone.now()
+    since = now - timedelta(days=config['WINDOW_DAYS'])
+    recent = Inquiry.objects.filter(created_at__gte=since, city__isnull=False)
+
+    counts = recent.order_by().values_list('city_id', 'area_id').annotate(n=Count('id'))
+    demand = {}
+    for city_id, area_id, n in counts:
+        demand[_place_keys(city_id, area_id or 0)] = n
+    if demand:
+        busiest = max(demand.values())
+        demand = {key: n / busiest for key, n in demand.items()}
+
+    empty = np.empty(0, dtype=np.int64)
+    best_groups, best_scores, best_pks = empty, np.empty(0), empty
+    last_pk = 0
+    while True:
+        rows = list(
+            recent.filter(pk__gt=last_pk).order_by('pk')
+            .values_list(*COLUMNS)[:config['CHUNK_SIZE']]
+        )
+        if not rows:
+            break
+        arrays = _to_arrays(rows)
+        scores = score_arrays(arrays, now.timestamp(), demand, config)
+        place = _place_keys(arrays['city_id'], arrays['area_id'])
+        city_wide = _place_keys(arrays['city_id'], np.zeros_like(arrays['area_id']))
+        # Areas are ranked under their packed place key and cities under the
+        # key with area 0; area-less inquiries only count city-wide.
+        has_area = arrays['area_id'] > 0
+        best_groups, best_scores, best_pks = _top_n(
+            np.concatenate([best_groups, place[has_area], city_wide]),
+            np.concatenate([best_scores, scores[has_area], scores]),
+            np.concatenate([best_pks, arrays['pk'][has_area], arrays['pk']]),
+            config['TOP_N'],
+        )
+        last_pk = rows[-1][0]
+
+    leads = {}
+    for group, score, pk in zip(best_groups.tolist(), best_scores.tolist(), best_pks.tolist()):
+        city_id, area_id = group >> 32, group & 0xFFFFFFFF
+        leads.setdefault((city_id, area_id or None), []).append((pk, round(score, 4)))
+    return leads
+
+
+def refresh_leads(config=None):
+    """
+    Recomputes every ranking and replaces the stored ones in a single
+    transaction, so readers see either the old or the new rankings. The
+    scoring runs before the transaction starts; the write itself is
+    ``TOP_N`` rows per place.
+    """
+    config = config or get_config()
+    leads = compute_leads(config)
+    computed_at = timezone.now()
+    rows = [
+        LeadRanking(
+            city_id=city_id, area_id=area_id, inquiry_id=pk,
+            rank=rank, score=score, computed_at=computed_at,
+        )
+        for (city_id, area_id), ranked in leads.items()
+        for rank, (pk, score) in enumerate(ranked, start=1)
+    ]
+    with transaction.atomic():
+        LeadRanking.objects.all().delete()
+        LeadRanking.objects.bulk_create(rows, batch_size=1000)
+    return leads
+
+
+def _schedule_refresh():
+    from .tasks import refresh_leads as refresh_leads_task
+
+    refresh_leads_task.delay()
+
+
+def get_leads(city_id, area_id=None, limit=None):
+    """
+    Returns the stored ranking for a city (or a city's area) as
+    (inquiry_id, score) pairs. A ranking older than ``REFRESH_SECONDS`` is
+    still served while the background task recomputes it. Before the first
+    refresh has run there is nothing to serve and the result is empty.
+    """
+    config = get_config()
+    rows = LeadRanking.objects.filter(city_id=city_id, area_id=area_id).order_by('rank')
+    if limit:
+        rows = rows[:limit]
+    rows = list(rows.values_list('inquiry_id', 'score', 'computed_at'))
+    if rows:
+        computed_at = rows[0][2]
+    else:
+        # Every row of a refresh shares its timestamp, so any row will do.
+        computed_at = LeadRanking.objects.order_by().values_list('computed_at', flat=True).first()
+    if computed_at is None or timezone.now() - computed_at > timedelta(seconds=config['REFRESH_SECONDS']):
+        _schedule_refresh()
+    return [(pk, score) for pk, score, _ in rows]
@@ -0,0 +1,329 @@
+"""
+Search over inquiry place and property names.
+
+Each inquiry gets one document made of the normalized names and alias keys
+of its city, area and property type, so a search for "cairo" also finds
+inquiries stored under "القاهرة" once the alias exists. The index lives in
+``inquiries_inquiry_fts``: an FTS5 table on SQLite, a table with a
+GIN-indexed tsvector column on PostgreSQL (see migration 0006). It backs
+the admin search; other backends fall back to plain ``icontains``.
+
+``search`` answers the public endpoint in two steps: every term is matched
+against the small alias tables, and the newest matching inquiries are read
+from the (lookup, created_at) indexes, a few per requested result. Their
+documents, read from the index by key, then rank them, so the inquiries the
+words describe best come first without scoring every match.
+"""
+import heapq
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import AreaAlias, CityAlias, Inquiry, PropertyTypeAlias
+from .text import normalize_text
+
+FTS_TABLE = 'inquiries_inquiry_fts'
+
+
+def is_supported():
+    return connection.vendor in ('sqlite', 'postgresql')
+
+
+def build_document(inquiry):
+    """
+    Every lookup row gets an alias for its own spelling when it is created
+    (see inquiries.locations), so the alias keys alone cover the names.
+    """
+    parts = []
+    if inquiry.city_id:
+        parts.extend(CityAlias.objects.filter(city_id=inquiry.city_id).values_list('key', flat=True))
+    if inquiry.area_id:
+        parts.extend(AreaAlias.objects.filter(area_id=inquiry.area_id).values_list('key', flat=True))
+    if inquiry.property_type_id:
+        parts.extend(
+            PropertyTypeAlias.objects.filter(property_type_id=inquiry.property_type_id)
+            .values_list('key', flat=True)
+        )
+    # Drop repeated words while keeping their first-seen order.
+    return ' '.join(dict.fromkeys(' '.join(parts).split()))
+
+
+def _match_expression(terms):
+    if connection.vendor == 'sqlite':
+        return ' AND '.join(f'"{term}"*' for term in terms)
+    return ' & '.join(f"'{term}':*" for term in terms)
+
+
+def _match_sql():
+    """
+    Returns SQL selecting the ids of inquiries that match one bound match
+    expression.
+    """
+    if connection.vendor == 'sqlite':
+        return f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s'
+    return f"SELECT inquiry_id FROM {FTS_TABLE} WHERE vector @@ to_tsquery('simple', %s)"
+
+
+def filter_queryset(queryset, query):
+    """
+    Narrows an Inquiry queryset to rows matching ``query`` without
+    materializing the id list, for use by the admin changelist.
+    """
+    terms = normalize_text(query).split()
+    if not terms:
+        return queryset
+    if not is_supported():
+        for term in terms:
+            queryset = queryset.filter(
+                Q(city__name__icontains=term)
+                | Q(area__name__icontains=term)
+                | Q(property_type__name__icontains=term)
+            )
+        return queryset
+    return queryset.filter(pk__in=RawSQL(_match_sql(), [_match_expression(terms)]))
+
+
+# Above this many matching lookups one query with IN beats one per lookup.
+MAX_LOOKUP_QUERIES = 50
+
+# Newest matches read per requested result for the index to rank.
+CANDIDATES_PER_RESULT = 5
+
+_LOOKUP_FIELDS = (
+    ('city_id', CityAlias, 'city_id'),
+    ('area_id', AreaAlias, 'area_id'),
+    ('property_type_id', PropertyTypeAlias, 'property_type_id'),
+)
+
+
+def _term_lookups(term):
+    """
+    Returns (field, id) pairs of the lookups with a word in one of their
+    alias keys starting with ``term``, as the full-text prefix match does.
+    """
+    pairs = set()
+    word = Q(key__startswith=term) | Q(key__contains=f' {term}')
+    for field, model, target in _LOOKUP_FIELDS:
+        pairs.update((field, pk) for pk in model.objects.filter(word).values_list(target, flat=True))
+    return pairs
+
+
+def _any_of(pairs):
+    condition = Q()
+    for field, _, _ in _LOOKUP_FIELDS:
+        ids = [pk for name, pk in pairs if name == field]
+        if ids:
+            condition |= Q(**{f'{field}__in': ids})
+    return condition
+
+
+def _newest(terms, limit):
+    """
+    Returns the ids of up to ``limit`` inquiries matching every term,
+    newest first.
+    """
+    matches = sorted((_term_lookups(term) for term in terms), key=len)
+    if not matches[0]:
+        return []
+
+    # The rarest term drives; the others only filter its candidates.
+    driver, others = matches[0], matches[1:]
+    queryset = Inquiry.objects.all()
+    for pairs in others:
+        queryset = queryset.filter(_any_of(pairs))
+    queryset = queryset.order_by('-created_at', '-pk').values_list('created_at', 'pk')
+    if len(driver) > MAX_LOOKUP_QUERIES:
+        return [pk for _, pk in queryset.filter(_any_of(driver))[:limit]]
+
+    # Each of these reads one (lookup, created_at) index backwards.
+    runs = [list(queryset.filter(**{field: pk})[:limit]) for field, pk in sorted(driver)]
+    ids = []
+    for _, pk in heapq.merge(*runs, reverse=True):
+        # An inquiry can match through its city and its area alike.
+        if not ids or ids[-1] != pk:
+            ids.append(pk)
+            if len(ids) == limit:
+                break
+    return ids
+
+
+def _relevance(ids, terms):
+    """
+    Scores each of ``ids`` that has a document by the share of its words
+    that ``terms`` name: a whole word counts fully, a prefix half. SQLite's
+    bm25 would weigh a common prefix by reading every document it matches;
+    these documents are a few words each and are read by key.
+    """
+    column = 'rowid' if connection.vendor == 'sqlite' else 'inquiry_id'
+    placeholders = ', '.join(['%s'] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT {column}, document FROM {FTS_TABLE} WHERE {column} IN ({placeholders})', ids)
+        documents = cursor.fetchall()
+    scores = {}
+    for pk, document in documents:
+        words = document.split()
+        named = sum(
+            1 if word in terms else 0.5 if any(word.startswith(term) for term in terms) else 0
+            for word in words
+        )
+        scores[pk] = named / len(words) if words else 0
+    return scores
+
+
+def search(query, limit=20):
+    """
+    Returns the ids of up to ``limit`` inquiries matching every word of
+    ``query``, best first.
+
+    Recency bounds the ranking: only the newest ``CANDIDATES_PER_RESULT``
+    matches per result are scored, and the newer of two equally relevant
+    ones comes first. A candidate not indexed yet ranks last.
+    """
+    terms = list(dict.fromkeys(normalize_text(query).split()))
+    if not terms:
+        return []
+    ids = _newest(terms, limit * CANDIDATES_PER_RESULT)
+    if len(ids) < 2 or not is_supported():
+        return ids[:limit]
+    relevance = _relevance(ids, terms)
+    # sorted() is stable, so equal scores keep their newest-first order.
+    return sorted(ids, key=lambda pk: -relevance.get(pk, float('-inf')))[:limit]
+
+
+def _upsert_sql():
+    if connection.vendor == 'sqlite':
+        return f'INSERT OR REPLACE INTO {FTS_TABLE} (rowid, document) VALUES (%s, %s)'
+    return (
+        f'INSERT INTO {FTS_TABLE} (inquiry_id, document) VALUES (%s, %s) '
+        f'ON CONFLICT (inquiry_id) DO UPDATE SET document = EXCLUDED.document'
+    )
+
+
+def index_inquiry(inquiry):
+    if not is_supported():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(_upsert_sql(), [inquiry.pk, build_document(inquiry)])
+
+
+_DOCUMENT_COLUMNS = ('pk',) + tuple(field for field, _, _ in _LOOKUP_FIELDS)
+
+
+def _alias_keys(model, target, ids=None):
+    """
+    Maps lookup ids to their alias keys, for the ``ids`` given or all.
+    """
+    queryset = model.objects.all() if ids is None else model.objects.filter(**{f'{target}__in': ids})
+    keys = {}
+    for target_id, key in queryset.values_list(target, 'key').iterator():
+        keys.setdefault(target_id, []).append(key)
+    return keys
+
+
+def _documents(rows, keys):
+    """
+    Builds [pk, document] pairs for rows of ``_DOCUMENT_COLUMNS``, as
+    ``build_document`` does, from one ``_alias_keys`` map per lookup.
+    """
+    documents = []
+    for pk, *lookup_ids in rows:
+        parts = [key for lookup_keys, lookup_id in zip(keys, lookup_ids) for key in lookup_keys.get(lookup_id, ())]
+        documents.append([pk, ' '.join(dict.fromkeys(' '.join(parts).split()))])
+    return documents
+
+
+def rebuild_index(chunk_size=2000):
+    """
+    Rewrites every document, walking inquiries in primary-key chunks.
+    Run after changes that can touch any document; ``reindex_lookup``
+    covers the inquiries of one city, area or property type.
+
+    Documents are replaced in place and each chunk commits on its own, so
+    the write lock is only held for one chunk at a time and searches keep
+    seeing either the old or the new document of every inquiry. Documents
+    left behind by deleted inquiries are dropped chunk by chunk as well.
+    """
+    if not is_supported():
+        return 0
+
+    keys = [_alias_keys(model, target) for _, model, target in _LOOKUP_FIELDS]
+    table = Inquiry._meta.db_table
+    if connection.vendor == 'sqlite':
+        # PostgreSQL removes documents through the foreign key's ON DELETE CASCADE.
+        orphans = (
+            f'DELETE FROM {FTS_TABLE} WHERE rowid > %s AND rowid <= %s '
+            f'AND rowid NOT IN (SELECT id FROM {table} WHERE id > %s AND id <= %s)'
+        )
+    else:
+        orphans = None
+
+    last_pk, total = 0, 0
+    while True:
+        rows = list(
+            Inquiry.objects.filter(pk__gt=last_pk).order_by('pk')
+            .values_list(*_DOCUMENT_COLUMNS)[:chunk_size]
+        )
+        # The last pass clears documents above the newest inquiry.
+        upper = rows[-1][0] if rows else 2 ** 63 - 1
+        with transaction.atomic(), connection.cursor() as cursor:
+            if rows:
+                cursor.executemany(_upsert_sql(), _documents(rows, keys))
+            if orphans:
+                cursor.execute(orphans, [last_pk, upper, last_pk, upper])
+        if not rows:
+            break
+        last_pk = upper
+        total += len(rows)
+    return total
+
+
+def reindex_lookup(field, target_id, chunk_size=2000):
+    """
+    Rewrites the documents of the inquiries whose ``field`` (``city_id``,
+    ``area_id`` or ``property_type_id``) is ``target_id``, after that row's
+    aliases changed. Only the alias keys those inquiries use are read.
+    Returns how many documents were rewritten.
+    """
+    if not is_supported():
+        return 0
+    queryset = Inquiry.objects.filter(**{field: target_id}).order_by('pk').values_list(*_DOCUMENT_COLUMNS)
+    last_pk, total = 0, 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last_pk)[:chunk_size])
+        if not rows:
+            return total
+        keys = [
+            _alias_keys(model, target, {row[position] for row in rows} - {None})
+            for position, (_, model, target) in enumerate(_LOOKUP_FIELDS, 1)
+        ]
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(_upsert_sql(), _documents(rows, keys))
+        last_pk = rows[-1][0]
+        total += len(rows)
+
+
+def unindex_inquiry(pk):
+    unindex_many([pk])
+
+
+def unindex_many(pks):
+    if not is_supported() or not pks:
+        return
+    column = 'rowid' if connection.vendor == 'sqlite' else 'inquiry_id'
+    placeholders = ', '.join(['%s'] * len(pks))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE {column} IN ({placeholders})', list(pks))
+
+
+@receiver(post_save, sender=Inquiry)
+def _index_on_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_inquiry(instance)
+
+
+@receiver(post_delete, sender=Inquiry)
+def _unindex_on_delete(sender, instance, **kwargs):
+    unindex_inquiry(instance.pk)
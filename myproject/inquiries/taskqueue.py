@@ -0,0 +1,280 @@
+"""
+A small task queue stored in the project database, for work a view can
+hand off instead of doing before it responds.
+
+Declare tasks in an app's ``tasks.py`` (the worker imports those modules)::
+
+    @task(max_attempts=5)
+    def send_welcome_email(user_id):
+        ...
+
+    send_welcome_email.delay(user.id)
+
+``delay`` inserts a row in the caller's transaction, so a task is only
+visible to workers once the view's work has committed. ``python manage.py
+run_tasks`` claims batches with ``SELECT ... FOR UPDATE SKIP LOCKED`` where
+the database supports it; on SQLite, whose writes are already serialized,
+it claims with a single ``UPDATE ... WHERE id IN (SELECT ... LIMIT n)``.
+Failed tasks are retried with exponential backoff until ``max_attempts``
+is reached.
+
+While a task runs, a heartbeat thread refreshes its ``locked_at`` every
+``HEARTBEAT_SECONDS``, so only tasks whose worker died look stale, however
+long they legitimately take. A stale task is queued again, or failed once
+it has used up its attempts (a task that kills its worker would otherwise
+come back forever). Outcomes are only written by the worker that still
+holds the task.
+"""
+import logging
+import threading
+import traceback
+from collections import Counter
+from datetime import timedelta
+
+from django.db import connection, connections, transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+
+from .models import BackgroundTask
+
+logger = logging.getLogger(__name__)
+
+registry = {}
+
+HEARTBEAT_SECONDS = 30
+
+
+class Task:
+    def __init__(self, func, name, max_attempts, backoff, unique):
+        self.func = func
+        self.name = name
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.unique = unique
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def delay(self, *args, **kwargs):
+        return self.enqueue(args=args, kwargs=kwargs)
+
+    def enqueue(self, args=(), kwargs=None, run_at=None):
+        """
+        Queues a call. Arguments must be JSON serializable. ``unique`` tasks
+        are not queued again while an earlier call is still waiting.
+        """
+        if self.unique and BackgroundTask.objects.filter(
+            name=self.name, status=BackgroundTask.STATUS_QUEUED
+        ).exists():
+            return None
+        return BackgroundTask.objects.create(
+            name=self.name,
+            payload={'args': list(args), 'kwargs': kwargs or {}},
+            max_attempts=self.max_attempts,
+            run_at=run_at or timezone.now(),
+        )
+
+
+def task(func=None, *, name=None, max_attempts=3, backoff=30, unique=False):
+    """
+    Registers ``func`` as a task. ``backoff`` is the delay in seconds before
+    the first retry; it doubles on every further attempt.
+    """
+    def decorator(func):
+        task_name = name or f'{func.__module__}.{func.__qualname__}'
+        registry[task_name] = Task(func, task_name, max_attempts, backoff, unique)
+        return registry[task_name]
+
+    return decorator(func) if func is not None else decorator
+
+
+def claim(worker_id, batch_size=10):
+    """
+    Marks up to ``batch_size`` due tasks as running for ``worker_id`` and
+    returns them. Concurrent workers never claim the same task.
+    """
+    now = timezone.now()
+    due = BackgroundTask.objects.filter(
+        status=BackgroundTask.STATUS_QUEUED, run_at__lte=now
+    ).order_by('run_at')
+    claimed = {
+        'status': BackgroundTask.STATUS_RUNNING,
+        'locked_by': worker_id,
+        'locked_at': now,
+        'attempts': F('attempts') + 1,
+    }
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(due.select_for_update(skip_locked=True).values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                return []
+            BackgroundTask.objects.filter(pk__in=ids).update(**claimed)
+    else:
+        # One statement that starts by writing takes SQLite's write lock up
+        # front, like BEGIN IMMEDIATE. A SELECT followed by an UPDATE would
+        # start as a reader and fail with SQLITE_BUSY, without waiting, when
+        # another worker writes before it upgrades. The status condition
+        # keeps it a compare-and-set on other backends.
+        BackgroundTask.objects.filter(
+            pk__in=due.values('pk')[:batch_size], status=BackgroundTask.STATUS_QUEUED
+        ).update(**claimed)
+    return list(
+        BackgroundTask.objects.filter(
+            status=BackgroundTask.STATUS_RUNNING, locked_by=worker_id, locked_at=now
+        ).order_by('run_at')
+    )
+
+
+class Heartbeat(threading.Thread):
+    """
+    Refreshes ``locked_at`` of a running task until stopped, on its own
+    database connection.
+    """
+
+    def __init__(self, background_task, interval):
+        super().__init__(name=f'task-heartbeat-{background_task.pk}', daemon=True)
+        self.background_task = background_task
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                try:
+                    BackgroundTask.objects.filter(
+                        pk=self.background_task.pk,
+                        status=BackgroundTask.STATUS_RUNNING,
+                        locked_by=self.background_task.locked_by,
+                    ).update(locked_at=timezone.now())
+                except Exception:
+                    logger.warning("Heartbeat of task #%s failed", self.background_task.pk, exc_info=True)
+        finally:
+            connections.close_all()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def execute(background_task):
+    """
+    Runs one claimed task and records the outcome. Returns the new status.
+    """
+    registered = registry.get(background_task.name)
+    heartbeat = Heartbeat(background_task, HEARTBEAT_SECONDS)
+    heartbeat.start()
+    try:
+        if registered is None:
+            raise LookupError(f"No task registered as {background_task.name!r}")
+        payload = background_task.payload or {}
+        registered.func(*payload.get('args', []), **payload.get('kwargs', {}))
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning("Task %s #%s failed", background_task.name, background_task.pk, exc_info=True)
+        background_task.last_error = error
+        if registered is not None and background_task.attempts < background_task.max_attempts:
+            delay = registered.backoff * 2 ** (background_task.attempts - 1)
+            background_task.status = BackgroundTask.STATUS_QUEUED
+            background_task.run_at = timezone.now() + timedelta(seconds=delay)
+        else:
+            background_task.status = BackgroundTask.STATUS_FAILED
+            background_task.finished_at = timezone.now()
+    else:
+        background_task.status = BackgroundTask.STATUS_DONE
+        background_task.finished_at = timezone.now()
+    finally:
+        heartbeat.stop()
+
+    worker_id = background_task.locked_by
+    background_task.locked_by = ''
+    background_task.locked_at = None
+    # A task requeued as stale may be running elsewhere by now; its new
+    # holder owns the row.
+    updated = BackgroundTask.objects.filter(
+        pk=background_task.pk, status=BackgroundTask.STATUS_RUNNING, locked_by=worker_id,
+    ).update(**{
+        field: getattr(background_task, field)
+        for field in ('status', 'run_at', 'last_error', 'finished_at', 'locked_by', 'locked_at')
+    })
+    if not updated:
+        logger.warning(
+            "Task %s #%s was taken over by another worker; its outcome here is discarded",
+            background_task.name, background_task.pk,
+        )
+    return background_task.status
+
+
+def requeue_stale(timeout):
+    """
+    Handles tasks whose worker stopped without reporting back (killed, OOM,
+    deploy): no heartbeat for ``timeout`` seconds. They are queued again,
+    or failed when they have no attempts left. Returns how many were
+    requeued.
+    """
+    now = timezone.now()
+    stale = BackgroundTask.objects.filter(
+        status=BackgroundTask.STATUS_RUNNING,
+        locked_at__lt=now - timedelta(seconds=timeout),
+    )
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=BackgroundTask.STATUS_FAILED, locked_by='', locked_at=None, finished_at=now,
+        last_error=f"The worker stopped responding for more than {timeout} s on the last attempt.",
+    )
+    if failed:
+        logger.warning("Failed %s stale task(s) that had no attempts left", failed)
+    return stale.update(status=BackgroundTask.STATUS_QUEUED, locked_by='', locked_at=None)
+
+
+def purge_finished(older_than):
+    """
+    Deletes done tasks finished more than ``older_than`` seconds ago.
+    Failed tasks are kept for inspection.
+    """
+    deleted, _ = BackgroundTask.objects.filter(
+        status=BackgroundTask.STATUS_DONE,
+        finished_at__lt=timezone.now() - timedelta(seconds=older_than),
+    ).delete()
+    return deleted
+
+
+def queue_stats():
+    """
+    Returns row counts per status and the age in seconds of the oldest due
+    task, which is the number to alert on.
+    """
+    counts = dict(
+        BackgroundTask.objects.order_by().values_list('status').annotate(n=Count('id'))
+    )
+    oldest = BackgroundTask.objects.filter(
+        status=BackgroundTask.STATUS_QUEUED, run_at__lte=timezone.now()
+    ).aggregate(oldest=Min('run_at'))['oldest']
+    return {
+        'counts': {status: counts.get(status, 0) for status, _ in BackgroundTask.STATUS_CHOICES},
+        'oldest_due_seconds': (timezone.now() - oldest).total_seconds() if oldest else 0.0,
+    }
+
+
+class WorkerMetrics:
+    """
+    Per-worker counters reported by ``run_tasks`` on exit and on demand.
+    """
+
+    def __init__(self):
+        self.outcomes = Counter()
+        self.durations = Counter()
+
+    def record(self, name, status, seconds):
+        self.outcomes[(name, status)] += 1
+        self.durations[name] += seconds
+
+    def summary(self):
+        lines = []
+        for name in sorted({name for name, _ in self.outcomes}):
+            runs = sum(n for (task_name, _), n in self.outcomes.items() if task_name == name)
+            statuses = ', '.join(
+                f'{status}={n}' for (task_name, status), n in sorted(self.outcomes.items())
+                if task_name == name
+            )
+            lines.append(f'{name}: {statuses}, avg {self.durations[name] / runs * 1000:.1f} ms')
+        return lines
@@ -0,0 +1,106 @@
+"""
+Background tasks for the inquiries app. Imported by the ``run_tasks``
+worker and, for the signal handlers below, by ``InquiriesConfig.ready``.
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import AreaAlias, CityAlias, Inquiry, PropertyTypeAlias
+from .taskqueue import task
+
+
+@task(unique=True, max_attempts=2)
+def refresh_leads():
+    from . import scoring
+
+    scoring.refresh_leads()
+
+
+@task(unique=True, max_attempts=2, backoff=300)
+def rebuild_search_index():
+    from . import search
+
+    search.rebuild_index()
+
+
+@task(max_attempts=2, backoff=300)
+def reindex_lookup(field, target_id):
+    from . import search
+
+    search.reindex_lookup(field, target_id)
+
+
+@task(max_attempts=1)
+def import_brokers(broker_import_id):
+    """
+    Runs an admin upload through inquiries.brokerimport, records the outcome
+    and deletes the uploaded files, whether the import succeeded or not.
+    The password hashing pool is forked here in the worker, never in a web
+    process.
+    """
+    from .brokerimport import import_brokers as run_import
+    from .models import BrokerImport
+
+    broker_import = BrokerImport.objects.get(pk=broker_import_id)
+    BrokerImport.objects.filter(pk=broker_import.pk).update(status=BrokerImport.STATUS_RUNNING)
+    status = BrokerImport.STATUS_FAILED
+    result = None
+    try:
+        with broker_import.csv_file.open('rb') as csv_file:
+            images = broker_import.images.open('rb') if broker_import.images else None
+            try:
+                result = run_import(csv_file, images, dry_run=broker_import.dry_run)
+            finally:
+                if images is not None:
+                    images.close()
+        status = BrokerImport.STATUS_DONE
+    finally:
+        for upload in (broker_import.csv_file, broker_import.images):
+            if upload:
+                upload.storage.delete(upload.name)
+        BrokerImport.objects.filter(pk=broker_import.pk).update(
+            status=status,
+            created=result.created if result else 0,
+            errors=[list(error) for error in result.errors] if result else [],
+            finished_at=timezone.now(),
+        )
+
+
+_ALIAS_TARGETS = {
+    CityAlias: 'city_id',
+    AreaAlias: 'area_id',
+    PropertyTypeAlias: 'property_type_id',
+}
+
+
+@receiver(pre_save, sender=CityAlias)
+@receiver(pre_save, sender=AreaAlias)
+@receiver(pre_save, sender=PropertyTypeAlias)
+def _remember_alias_target(sender, instance, raw=False, **kwargs):
+    # An edit can move the alias to another row, whose old inquiries lose
+    # the spelling and need reindexing too.
+    if raw or instance._state.adding:
+        return
+    field = _ALIAS_TARGETS[sender]
+    instance._previous_target = (
+        sender.objects.filter(pk=instance.pk).values_list(field, flat=True).first()
+    )
+
+
+@receiver([post_save, post_delete], sender=CityAlias)
+@receiver([post_save, post_delete], sender=AreaAlias)
+@receiver([post_save, post_delete], sender=PropertyTypeAlias)
+def _reindex_on_alias_change(sender, instance, created=False, raw=False, **kwargs):
+    # Only the inquiries of the row the alias names carry its key in their
+    # documents. Aliases created by the location resolver point at brand-new
+    # rows that no indexed inquiry references yet.
+    if raw:
+        return
+    field = _ALIAS_TARGETS[sender]
+    targets = {getattr(instance, field), getattr(instance, '_previous_target', None)} - {None}
+    for target_id in sorted(targets):
+        if created and not Inquiry.objects.filter(**{field: target_id}).exists():
+            continue
+        transaction.on_commit(lambda target_id=target_id: reindex_lookup.delay(field, target_id))
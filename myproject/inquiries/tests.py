@@ -1,3 +1,898 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
\ No newline at end of file
+import numpy as np
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.paginator import EmptyPage
+from django.http import QueryDict
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from inquiries import archive, brokerimport, events, facets, locations, scoring, search, taskqueue, views, warmup
+from inquiries.changelists import AutocompleteFilter, EstimatedCountPaginator
+from inquiries.management.commands import importtime_report
+from inquiries.models import (
+    Area, AreaAlias, BackgroundTask, BrokerImport, City, CityAlias, Inquiry, InquiryArchive, LeadRanking,
+    LookupVersion, PaymentLog, UserProfile,
+)
+
+
+class LookupTestCase(TestCase):
+    """
+    Resolver ids cached by one test point at rows its rollback removed.
+    """
+
+    def setUp(self):
+        locations.clear_cache()
+        self.addCleanup(locations.clear_cache)
+
+
+class LocationResolverTests(LookupTestCase):
+
+    def test_lookup_miss_is_not_cached(self):
+        self.assertIsNone(locations.resolve_city('Alexandria', create=False))
+        city_id = locations.resolve_city('Alexandria')
+        self.assertIsNotNone(city_id)
+        self.assertEqual(City.objects.get(pk=city_id).name, 'Alexandria')
+        self.assertEqual(locations.resolve_city('alexandria', create=False), city_id)
+
+    def test_read_only_endpoint_does_not_break_create(self):
+        self.client.get('/inquiries/leads/', {'city': 'Mansoura'})
+        response = self.client.post(
+            '/inquiries/create/',
+            json.dumps({'transaction_type': 'rent', 'city-rent': 'Mansoura', 'area-rent': 'Toriel'}),
+            content_type='application/json',
+        )
+        inquiry = Inquiry.objects.select_related('city', 'area').get(pk=response.json()['id'])
+        self.assertEqual(inquiry.city.name, 'Mansoura')
+        self.assertEqual(inquiry.area.city_id, inquiry.city_id)
+
+    def test_cache_size_is_bounded(self):
+        names = ['Cairo', 'Giza', 'Aswan', 'Luxor', 'Tanta']
+        for name in names:
+            locations.resolve_city(name)
+        locations.clear_cache()
+        original = locations.MAX_CACHE_SIZE
+        locations.MAX_CACHE_SIZE = 3
+        self.addCleanup(setattr, locations, 'MAX_CACHE_SIZE', original)
+        for name in names:
+            locations.resolve_city(name, create=False)
+        self.assertEqual(len(locations._cache), 3)
+        self.assertNotIn(('city', 'cairo'), locations._cache)
+        self.assertIn(('city', 'tanta'), locations._cache)
+
+
+    def test_area_without_city_is_created_once(self):
+        first = locations.resolve_area('Sahel')
+        locations.clear_cache()
+        AreaAlias.objects.filter(area_id=first).delete()
+        self.assertEqual(locations.resolve_area('Sahel'), first)
+        self.assertEqual(Area.objects.filter(city=None, name='Sahel').count(), 1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Area.objects.create(name='Sahel')
+
+    def test_admin_typed_alias_is_normalized(self):
+        cairo = City.objects.create(name='Cairo')
+        alias = CityAlias(city=cairo, key='  El Qahira ')
+        alias.full_clean()
+        alias.save()
+        self.assertEqual(alias.key, 'el qahira')
+        self.assertEqual(locations.resolve_city('EL QAHIRA', create=False), cairo.pk)
+        self.assertEqual(City.objects.count(), 1)
+
+    def test_area_alias_keeps_the_area_city(self):
+        cairo = City.objects.create(name='Cairo')
+        giza = City.objects.create(name='Giza')
+        maadi = Area.objects.create(city=cairo, name='Maadi')
+        with self.assertRaises(ValidationError):
+            AreaAlias(area=maadi, city=giza, key='maadi').full_clean()
+        alias = AreaAlias.objects.create(area=maadi, key='El Maadi')
+        self.assertEqual((alias.city_id, alias.key), (cairo.pk, 'el maadi'))
+        self.assertEqual(locations.resolve_area('el-maadi', cairo.pk, create=False), maadi.pk)
+
+    def test_alias_edit_reaches_other_processes(self):
+        cairo = locations.resolve_city('Cairo')
+        giza = locations.resolve_city('Giza')
+        self.assertEqual(locations.resolve_city('Cairo', create=False), cairo)
+        # Another worker re-points the alias: only the version row changes here.
+        with mock.patch.object(locations, 'clear_cache'):
+            CityAlias.objects.filter(key='cairo').update(city_id=giza)
+            locations.bump_version()
+        self.assertEqual(locations.resolve_city('Cairo', create=False), cairo)
+        locations._version['checked_at'] -= locations.VERSION_CHECK_SECONDS
+        self.assertEqual(locations.resolve_city('Cairo', create=False), giza)
+
+    def test_new_alias_does_not_invalidate(self):
+        locations.resolve_city('Cairo')
+        self.assertFalse(LookupVersion.objects.exists())
+
+
+class LocationMergeTests(LookupTestCase):
+
+    def test_merge_cities_moves_inquiries_areas_and_aliases(self):
+        cairo = City.objects.get(pk=locations.resolve_city('Cairo'))
+        misspelt = City.objects.get(pk=locations.resolve_city('Kairo'))
+        maadi = locations.resolve_area('Maadi', cairo.pk)
+        maadi_dup = locations.resolve_area('Maadi', misspelt.pk)
+        zamalek = locations.resolve_area('Zamalek', misspelt.pk)
+        inquiries = [
+            Inquiry.objects.create(city=misspelt, area_id=maadi_dup),
+            Inquiry.objects.create(city=misspelt, area_id=zamalek),
+            Inquiry.objects.create(city=cairo, area_id=maadi),
+        ]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(locations.merge(cairo, [misspelt]), 2)
+
+        self.assertFalse(City.objects.filter(pk=misspelt.pk).exists())
+        self.assertEqual(
+            [(i.city_id, i.area_id) for i in Inquiry.objects.filter(pk__in=[i.pk for i in inquiries]).order_by('pk')],
+            [(cairo.pk, maadi), (cairo.pk, zamalek), (cairo.pk, maadi)],
+        )
+        self.assertEqual(Area.objects.filter(city=cairo).count(), 2)
+        self.assertEqual(
+            set(AreaAlias.objects.filter(city=cairo).values_list('key', 'area_id')),
+            {('maadi', maadi), ('zamalek', zamalek)},
+        )
+        self.assertEqual(locations.resolve_city('Kairo', create=False), cairo.pk)
+        self.assertTrue(
+            BackgroundTask.objects.filter(name='inquiries.tasks.reindex_lookup', payload__args=['city_id', cairo.pk])
+            .exists()
+        )
+
+    def test_areas_of_different_cities_are_not_merged(self):
+        maadi = Area.objects.get(pk=locations.resolve_area('Maadi', locations.resolve_city('Cairo')))
+        dokki = Area.objects.get(pk=locations.resolve_area('Dokki', locations.resolve_city('Giza')))
+        with self.assertRaises(ValueError):
+            locations.merge(maadi, [dokki])
+        self.assertTrue(Area.objects.filter(pk=dokki.pk).exists())
+
+
+class LeadScoringTests(LookupTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.city_id = locations.resolve_city('Cairo')
+        self.area_id = locations.resolve_area('Maadi', self.city_id)
+        self.inquiries = [
+            Inquiry.objects.create(city_id=self.city_id, area_id=self.area_id, min_price=5000, max_price=6000),
+            Inquiry.objects.create(city_id=self.city_id, bedrooms=2),
+        ]
+
+    def test_request_never_scores(self):
+        with mock.patch.object(scoring, 'compute_leads') as compute:
+            self.assertEqual(scoring.get_leads(self.city_id), [])
+        compute.assert_not_called()
+        self.assertTrue(BackgroundTask.objects.filter(name='inquiries.tasks.refresh_leads').exists())
+
+    def test_stored_rankings_are_served(self):
+        scoring.refresh_leads()
+        city_wide = scoring.get_leads(self.city_id)
+        self.assertEqual({pk for pk, _ in city_wide}, {inquiry.pk for inquiry in self.inquiries})
+        self.assertEqual(
+            [pk for pk, _ in scoring.get_leads(self.city_id, self.area_id)], [self.inquiries[0].pk]
+        )
+        self.assertEqual(len(scoring.get_leads(self.city_id, limit=1)), 1)
+        self.assertFalse(BackgroundTask.objects.exists())
+
+    def test_refresh_replaces_rankings(self):
+        scoring.refresh_leads()
+        self.inquiries[1].delete()
+        scoring.refresh_leads()
+        self.assertEqual(LeadRanking.objects.filter(area_id=None).count(), 1)
+
+    def test_inverted_budget_scores_like_a_missing_one(self):
+        nan = float('nan')
+        budgets = [(5000, 6000), (6000, 5000), (nan, nan), (5000, nan)]
+        arrays = {
+            name: np.full(len(budgets), nan)
+            for name in ('bedrooms', 'bathrooms', 'min_size', 'max_size')
+        }
+        arrays.update(
+            min_price=np.array([low for low, _ in budgets]),
+            max_price=np.array([high for _, high in budgets]),
+            furnished=np.zeros(len(budgets)),
+            created_at=np.zeros(len(budgets)),
+            city_id=np.ones(len(budgets), dtype=np.int64),
+            area_id=np.zeros(len(budgets), dtype=np.int64),
+        )
+        config = {**scoring.get_config(), 'WEIGHTS': {'budget': 1, 'specificity': 0, 'recency': 0, 'demand': 0}}
+        scores = scoring.score_arrays(arrays, 0.0, {}, config)
+        np.testing.assert_allclose(scores, [1 - 1000 / 6000, 0.0, 0.0, 0.5])
+
+
+class FacetIndexTests(LookupTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cairo = locations.resolve_city('Cairo')
+        self.giza = locations.resolve_city('Giza')
+        self.villa = locations.resolve_property_type('Villa')
+        for city_id, bedrooms, max_price in [
+            (self.cairo, 2, 4000), (self.cairo, 3, 15000), (self.giza, 2, 15000),
+            (self.giza, None, None), (self.cairo, 7, 60000),
+        ]:
+            Inquiry.objects.create(
+                city_id=city_id, property_type_id=self.villa, bedrooms=bedrooms, max_price=max_price,
+            )
+        self.index = facets.FacetIndex(facets.DEFAULTS['PRICE_BINS'])
+        self.index.load_new(chunk_size=2)
+
+    def counts(self, **filters):
+        return self.index.snapshot.counts(filters)
+
+    def test_unfiltered_counts(self):
+        counts = self.counts()
+        self.assertEqual(counts['total'], 5)
+        self.assertEqual(
+            [(row['name'], row['count']) for row in counts['city']], [('Cairo', 3), ('Giza', 2)]
+        )
+        self.assertEqual([row['count'] for row in counts['bedrooms']], [1, 0, 2, 1, 0, 1])
+
+    def test_facet_ignores_its_own_filter(self):
+        counts = self.counts(city=self.cairo, bedrooms=2)
+        self.assertEqual(counts['total'], 1)
+        self.assertEqual(
+            [(row['name'], row['count']) for row in counts['city']], [('Cairo', 1), ('Giza', 1)]
+        )
+        self.assertEqual([row['count'] for row in counts['bedrooms']], [0, 0, 1, 1, 0, 1])
+
+    def test_price_filter_and_bins(self):
+        counts = self.counts(min_price=10000, max_price=20000)
+        # Budgets overlapping the range match, and so do budgets left open.
+        self.assertEqual(counts['total'], 4)
+        by_bin = {row['min']: row['count'] for row in counts['price'] if row['count']}
+        self.assertEqual(by_bin, {2500: 1, 10000: 2, 50000: 1})
+
+    def test_unknown_lookup_matches_nothing(self):
+        self.assertEqual(self.counts(city=-1)['total'], 0)
+
+    def test_append_only_adds_new_rows(self):
+        snapshot = self.index.snapshot
+        Inquiry.objects.create(city_id=self.giza, bedrooms=2)
+        self.assertEqual(self.index.load_new(chunk_size=100), 1)
+        self.assertEqual(self.counts(city=self.giza)['total'], 3)
+        # Older snapshots keep answering for the rows they were built on.
+        self.assertEqual(snapshot.counts({'city': self.giza})['total'], 2)
+
+    def test_lookup_filters_keep_no_bitmaps(self):
+        self.assertEqual(set(self.index.bitmaps), {'transaction_type', 'bedrooms', 'price'})
+        self.assertEqual(self.counts(city=self.giza, property_type=self.villa)['total'], 2)
+
+
+class FacetCacheTests(TestCase):
+
+    def test_requests_do_not_wait_for_the_first_build(self):
+        cache = facets.FacetCache()
+        release = threading.Event()
+        built = facets.FacetIndex(facets.DEFAULTS['PRICE_BINS'])
+
+        def slow_build(config):
+            release.wait(5)
+            return built
+
+        with (
+            mock.patch.object(cache, '_build', side_effect=slow_build),
+            mock.patch.object(facets, 'connections'),
+            mock.patch.dict(facets.DEFAULTS, {'REFRESH_SECONDS': 60}),
+        ):
+            self.assertIsNone(cache.get())
+            release.set()
+            for _ in range(100):
+                if cache.get() is not None:
+                    break
+                time.sleep(0.01)
+            self.assertIs(cache.get(), built.snapshot)
+
+    def test_view_answers_503_until_ready(self):
+        with mock.patch.object(facets.facet_cache, 'get', return_value=None):
+            response = self.client.get('/inquiries/facets/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+
+class SearchIndexTests(LookupTestCase):
+
+    def documents(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT rowid, document FROM {search.FTS_TABLE} ORDER BY rowid')
+            return cursor.fetchall()
+
+    def test_rebuild_rewrites_documents_in_chunks(self):
+        cairo = locations.resolve_city('Cairo')
+        inquiries = [Inquiry.objects.create(city_id=cairo) for _ in range(5)]
+        search.unindex_inquiry(inquiries[0].pk)
+        # A document whose inquiry is gone, e.g. after a raw delete.
+        search.index_inquiry(Inquiry(pk=inquiries[-1].pk + 10, city_id=cairo))
+        with connection.cursor() as cursor:
+            cursor.execute(f'UPDATE {search.FTS_TABLE} SET document = %s', ['stale'])
+
+        self.assertEqual(search.rebuild_index(chunk_size=2), 5)
+        self.assertEqual(self.documents(), [(inquiry.pk, 'cairo') for inquiry in inquiries])
+
+    def test_alias_change_reindexes_only_the_inquiries_of_its_row(self):
+        cairo = locations.resolve_city('Cairo')
+        giza = locations.resolve_city('Giza')
+        in_cairo = [Inquiry.objects.create(city_id=cairo) for _ in range(2)]
+        in_giza = Inquiry.objects.create(city_id=giza)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            alias = CityAlias.objects.create(city_id=cairo, key='kahira')
+        queued = BackgroundTask.objects.filter(name='inquiries.tasks.reindex_lookup')
+        self.assertEqual([task.payload['args'] for task in queued], [['city_id', cairo]])
+        self.assertEqual(search.reindex_lookup('city_id', cairo, chunk_size=1), 2)
+        self.assertEqual(
+            self.documents(), [(inquiry.pk, 'cairo kahira') for inquiry in in_cairo] + [(in_giza.pk, 'giza')],
+        )
+
+        queued.delete()
+        alias.city_id = giza
+        with self.captureOnCommitCallbacks(execute=True):
+            alias.save()
+        self.assertEqual(
+            sorted(task.payload['args'] for task in queued), [['city_id', cairo], ['city_id', giza]],
+        )
+
+    def test_search_ranks_recent_matches_of_every_word(self):
+        cairo = locations.resolve_city('Cairo')
+        new_cairo = locations.resolve_city('New Cairo')
+        giza = locations.resolve_city('Giza')
+        villa = locations.resolve_property_type('Villa')
+        maadi = locations.resolve_area('Maadi', cairo)
+        inquiries = [
+            Inquiry.objects.create(city_id=cairo, area_id=maadi, property_type_id=villa),
+            Inquiry.objects.create(city_id=new_cairo, property_type_id=villa),
+            Inquiry.objects.create(city_id=giza, property_type_id=villa),
+            Inquiry.objects.create(city_id=cairo),
+        ]
+        Inquiry.objects.filter(pk=inquiries[1].pk).update(created_at=timezone.now() + timedelta(days=1))
+        pks = [inquiry.pk for inquiry in inquiries]
+
+        self.assertEqual(search.search('cai vil'), [pks[1], pks[0]])
+        # Only Cairo itself beats newer inquiries with longer documents.
+        self.assertEqual(search.search('cairo'), [pks[3], pks[1], pks[0]])
+        self.assertEqual(search.search('cairo', limit=2), [pks[3], pks[1]])
+        self.assertEqual(search.search('maadi cairo'), [pks[0]])
+        self.assertEqual(search.search('alexandria villa'), [])
+        with mock.patch.object(search, 'MAX_LOOKUP_QUERIES', 1):
+            self.assertEqual(search.search('cairo'), [pks[3], pks[1], pks[0]])
+        with mock.patch.object(search, 'CANDIDATES_PER_RESULT', 1):
+            self.assertEqual(search.search('cairo', limit=1), [pks[1]])
+        search.unindex_inquiry(pks[3])
+        self.assertEqual(search.search('cairo'), [pks[1], pks[0], pks[3]])
+
+        results = self.client.get('/inquiries/search/', {'q': 'giza'}).json()['results']
+        self.assertEqual([row['id'] for row in results], [pks[2]])
+        self.assertNotIn('score', results[0])
+
+    def test_filter_queryset_matches_every_word_through_the_index(self):
+        cairo = locations.resolve_city('Cairo')
+        CityAlias.objects.create(city_id=cairo, key='القاهرة')
+        villa = locations.resolve_property_type('Villa')
+        inquiries = [
+            Inquiry.objects.create(city_id=cairo, property_type_id=villa),
+            Inquiry.objects.create(city_id=cairo),
+            Inquiry.objects.create(city_id=locations.resolve_city('Giza'), property_type_id=villa),
+        ]
+        search.rebuild_index()
+
+        def matches(query):
+            return sorted(search.filter_queryset(Inquiry.objects.all(), query).values_list('pk', flat=True))
+
+        self.assertEqual(matches('القاهره vil'), [inquiries[0].pk])
+        self.assertEqual(matches('cai'), [inquiries[0].pk, inquiries[1].pk])
+        self.assertEqual(matches('  '), sorted(inquiry.pk for inquiry in inquiries))
+        with mock.patch.object(search, 'is_supported', return_value=False):
+            self.assertEqual(matches('villa giza'), [inquiries[2].pk])
+
+
+@taskqueue.task(name='tests.record')
+def record_task(value):
+    TaskQueueTests.calls.append(value)
+
+
+@taskqueue.task(name='tests.fail', max_attempts=3, backoff=10)
+def failing_task():
+    raise RuntimeError('boom')
+
+
+class TaskQueueTests(TestCase):
+    calls = []
+
+    def setUp(self):
+        TaskQueueTests.calls = []
+
+    def test_claim_takes_due_tasks_once(self):
+        due = [record_task.delay(n) for n in range(3)]
+        record_task.enqueue(args=[99], run_at=timezone.now() + timedelta(hours=1))
+
+        first = taskqueue.claim('worker-a', batch_size=2)
+        self.assertEqual([t.pk for t in first], [due[0].pk, due[1].pk])
+        self.assertTrue(all(t.status == BackgroundTask.STATUS_RUNNING and t.attempts == 1 for t in first))
+        second = taskqueue.claim('worker-b', batch_size=10)
+        self.assertEqual([t.pk for t in second], [due[2].pk])
+        self.assertEqual(taskqueue.claim('worker-c'), [])
+
+    def test_success_marks_task_done(self):
+        record_task.delay('hello')
+        [claimed] = taskqueue.claim('worker')
+        self.assertEqual(taskqueue.execute(claimed), BackgroundTask.STATUS_DONE)
+        self.assertEqual(self.calls, ['hello'])
+        claimed.refresh_from_db()
+        self.assertIsNotNone(claimed.finished_at)
+        self.assertEqual(claimed.locked_by, '')
+
+    def test_failure_retries_with_exponential_backoff(self):
+        background_task = failing_task.delay()
+        for attempt, delay in [(1, 10), (2, 20)]:
+            BackgroundTask.objects.filter(pk=background_task.pk).update(run_at=timezone.now())
+            [claimed] = taskqueue.claim('worker')
+            before = timezone.now()
+            with self.assertLogs('inquiries.taskqueue', 'WARNING'):
+                self.assertEqual(taskqueue.execute(claimed), BackgroundTask.STATUS_QUEUED)
+            claimed.refresh_from_db()
+            self.assertEqual(claimed.attempts, attempt)
+            self.assertIn('boom', claimed.last_error)
+            self.assertAlmostEqual((claimed.run_at - before).total_seconds(), delay, delta=1)
+
+        BackgroundTask.objects.filter(pk=background_task.pk).update(run_at=timezone.now())
+        [claimed] = taskqueue.claim('worker')
+        with self.assertLogs('inquiries.taskqueue', 'WARNING'):
+            self.assertEqual(taskqueue.execute(claimed), BackgroundTask.STATUS_FAILED)
+
+    def test_unknown_task_fails_without_retry(self):
+        BackgroundTask.objects.create(name='tests.missing', payload={}, run_at=timezone.now())
+        [claimed] = taskqueue.claim('worker')
+        with self.assertLogs('inquiries.taskqueue', 'WARNING'):
+            self.assertEqual(taskqueue.execute(claimed), BackgroundTask.STATUS_FAILED)
+
+    def test_unique_task_is_queued_once(self):
+        rebuild = taskqueue.registry['inquiries.tasks.rebuild_search_index']
+        self.assertIsNotNone(rebuild.delay())
+        self.assertIsNone(rebuild.delay())
+        self.assertEqual(BackgroundTask.objects.filter(name=rebuild.name).count(), 1)
+
+    def test_stale_task_without_attempts_left_fails(self):
+        long_ago = timezone.now() - timedelta(hours=1)
+        retry = record_task.delay('retry')
+        spent = failing_task.delay()
+        BackgroundTask.objects.filter(pk=retry.pk).update(
+            status=BackgroundTask.STATUS_RUNNING, attempts=1, locked_by='dead', locked_at=long_ago,
+        )
+        BackgroundTask.objects.filter(pk=spent.pk).update(
+            status=BackgroundTask.STATUS_RUNNING, attempts=3, locked_by='dead', locked_at=long_ago,
+        )
+        with self.assertLogs('inquiries.taskqueue', 'WARNING'):
+            self.assertEqual(taskqueue.requeue_stale(600), 1)
+        retry.refresh_from_db()
+        spent.refresh_from_db()
+        self.assertEqual((retry.status, retry.locked_by), (BackgroundTask.STATUS_QUEUED, ''))
+        self.assertEqual(spent.status, BackgroundTask.STATUS_FAILED)
+        self.assertIsNotNone(spent.finished_at)
+
+    def test_outcome_is_not_written_over_a_new_holder(self):
+        record_task.delay('twice')
+        [claimed] = taskqueue.claim('worker-a')
+        # Requeued as stale and claimed by another worker meanwhile.
+        BackgroundTask.objects.filter(pk=claimed.pk).update(locked_by='worker-b')
+        with self.assertLogs('inquiries.taskqueue', 'WARNING'):
+            taskqueue.execute(claimed)
+        row = BackgroundTask.objects.get(pk=claimed.pk)
+        self.assertEqual((row.status, row.locked_by), (BackgroundTask.STATUS_RUNNING, 'worker-b'))
+
+    def test_worker_survives_locked_database(self):
+        record_task.delay('after lock')
+        real_claim = taskqueue.claim
+        failures = [OperationalError('database is locked')]
+
+        def flaky_claim(*args):
+            if failures:
+                raise failures.pop()
+            return real_claim(*args)
+
+        with mock.patch.object(taskqueue, 'claim', side_effect=flaky_claim):
+            call_command('run_tasks', once=True, poll_interval=0, stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(self.calls, ['after lock'])
+
+
+class WarmUpTests(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.dict(warmup._state, {'serving': False})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_forked_worker_gets_its_own_connections(self):
+        with mock.patch.object(warmup.connections, 'close_all') as close_all:
+            warmup._before_fork()
+        close_all.assert_called_once_with()
+        with mock.patch.object(warmup, '_run') as run:
+            warmup._after_fork_in_child()
+        run.assert_called_once_with(warmup.PROCESS_STEPS)
+
+    def test_serving_process_forks_untouched(self):
+        warmup._mark_serving()
+        with (
+            mock.patch.object(warmup.connections, 'close_all') as close_all,
+            mock.patch.object(warmup, '_run') as run,
+        ):
+            warmup._before_fork()
+            warmup._after_fork_in_child()
+        close_all.assert_not_called()
+        run.assert_not_called()
+
+    def test_worker_primes_the_facet_index(self):
+        Inquiry.objects.create(transaction_type='sale')
+        with mock.patch.object(facets, 'facet_cache', facets.FacetCache()) as cache:
+            report = warmup._run(warmup.PROCESS_STEPS)
+            self.assertIsNotNone(cache._index)
+        self.assertEqual(report['facets'][0], 1)
+
+    def test_parse_importtime(self):
+        output = (
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       120 |        120 |     _io\n'
+            'import time:      2500 |      41000 | numpy\n'
+            'unrelated line\n'
+        )
+        self.assertEqual(importtime_report.parse_importtime(output), {'_io': (120, 120), 'numpy': (2500, 41000)})
+
+
+class ChangeListOrderingTests(TestCase):
+
+    def changelist(self, model, **params):
+        request = RequestFactory().get('/', params)
+        request.user = mock.Mock(is_active=True, is_staff=True, has_perm=lambda *args: True)
+        return admin.site.get_model_admin(model).get_changelist_instance(request)
+
+    def test_pk_ordering_pages_by_cursor(self):
+        cairo = City.objects.create(name='Cairo')
+        inquiries = [Inquiry.objects.create(city=cairo) for _ in range(3)]
+        changelist = self.changelist(Inquiry)
+        self.assertTrue(changelist.keyset)
+        self.assertEqual(list(changelist.result_list), inquiries[::-1])
+        older = self.changelist(Inquiry, before=inquiries[1].pk)
+        self.assertEqual(list(older.result_list), [inquiries[0]])
+
+    def pages(self, model, **params):
+        """
+        Follows the cursor links from the first page and returns the pages.
+        """
+        pages, cursor = [], None
+        while True:
+            changelist = self.changelist(model, **params, **({'before': cursor} if cursor else {}))
+            self.assertTrue(changelist.keyset)
+            pages.append(list(changelist.result_list))
+            if changelist.next_page_url is None:
+                return pages
+            cursor = QueryDict(changelist.next_page_url.lstrip('?'))['before']
+
+    def test_payments_page_by_date_cursor(self):
+        now = timezone.now()
+        broker = UserProfile.objects.create(full_name='B', email='b@example.com', national_id='1', phone='1')
+        # Two payments share a date, so the cursor needs the pk too.
+        logs = [
+            PaymentLog.objects.create(broker=broker, amount=100, payment_date=now - timedelta(days=days))
+            for days in (3, 1, 2, 1, 4)
+        ]
+        with mock.patch.object(admin.site.get_model_admin(PaymentLog), 'list_per_page', 2):
+            pages = self.pages(PaymentLog)
+        self.assertEqual(pages, [[logs[3], logs[1]], [logs[2], logs[0]], [logs[4]]])
+
+    def test_ascending_ordering_pages_forward(self):
+        now = timezone.now()
+        tasks = [
+            BackgroundTask.objects.create(name=str(hours), payload={}, run_at=now + timedelta(hours=hours))
+            for hours in (2, 0, 1)
+        ]
+        with mock.patch.object(admin.site.get_model_admin(BackgroundTask), 'list_per_page', 2):
+            pages = self.pages(BackgroundTask)
+        self.assertEqual(pages, [[tasks[1], tasks[2]], [tasks[0]]])
+
+    def test_sorting_by_a_column_uses_numbered_pages_past_the_cap(self):
+        cairo = City.objects.create(name='Cairo')
+        inquiries = [Inquiry.objects.create(city=cairo, bedrooms=n) for n in range(7)]
+        model_admin = admin.site.get_model_admin(Inquiry)
+        with (
+            mock.patch.object(model_admin, 'list_per_page', 2),
+            mock.patch.object(EstimatedCountPaginator, 'count_cap', 3),
+        ):
+            changelist = self.changelist(Inquiry, city__id__exact=cairo.pk, o='1', p='3')
+        self.assertFalse(changelist.keyset)
+        self.assertEqual(changelist.result_count, 3)
+        self.assertTrue(changelist.paginator.is_capped)
+        self.assertEqual(list(changelist.result_list), inquiries[4:6])
+        self.assertIn('p=4', changelist.next_page_url)
+
+    def test_paginator_estimates_only_the_unfiltered_table(self):
+        cairo = City.objects.create(name='Cairo')
+        inquiries = [Inquiry.objects.create(city=cairo) for _ in range(3)]
+        Inquiry.objects.filter(pk=inquiries[0].pk).delete()
+        with mock.patch.object(EstimatedCountPaginator, 'exact_below', 2):
+            paginator = EstimatedCountPaginator(Inquiry.objects.order_by('pk'), 1)
+            # The highest primary key stands in on SQLite, deleted rows and all.
+            self.assertEqual((paginator.count, paginator.is_estimate), (inquiries[-1].pk, True))
+            self.assertEqual(list(paginator.page(2)), [inquiries[2]])
+            self.assertEqual(list(paginator.page(paginator.num_pages + 5)), [])
+            with self.assertRaises(EmptyPage):
+                paginator.page(0)
+
+            filtered = EstimatedCountPaginator(Inquiry.objects.filter(city=cairo).order_by('pk'), 1)
+            self.assertEqual((filtered.count, filtered.is_estimate, filtered.is_capped), (2, False, False))
+            with self.assertRaises(EmptyPage):
+                filtered.page(3)
+        self.assertEqual(EstimatedCountPaginator([1, 2, 3], 2).count, 3)
+
+    def test_autocomplete_filter_lists_no_targets(self):
+        broker = UserProfile.objects.create(full_name='Amal', email='a@example.com', national_id='1', phone='1')
+        PaymentLog.objects.create(broker=broker, amount=100, payment_date=timezone.now())
+        changelist = self.changelist(PaymentLog, broker__id__exact=broker.pk)
+        [spec] = [spec for spec in changelist.filter_specs if spec.field_path == 'broker']
+        self.assertIsInstance(spec, AutocompleteFilter)
+        self.assertTrue(spec.has_output())
+        self.assertEqual(spec.lookup_choices, [])
+        widget = spec.rendered_widget()
+        self.assertIn('data-filter-param="broker__id__exact"', widget)
+        self.assertIn(f'<option value="{broker.pk}" selected>', widget)
+
+        user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pass')
+        self.client.force_login(user)
+        response = self.client.get('/admin/inquiries/paymentlog/', {'broker__id__exact': broker.pk})
+        self.assertContains(response, 'select[data-filter-param="broker__id__exact"]')
+
+
+class ArchiveTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(INQUIRY_ARCHIVE_DIR=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.cutoff = timezone.now() - timedelta(days=30)
+        self.old = [Inquiry.objects.create(transaction_type='sale') for _ in range(3)]
+        Inquiry.objects.update(created_at=self.cutoff - timedelta(days=1))
+        self.new = Inquiry.objects.create(transaction_type='sale')
+
+    def test_rows_left_in_both_places_are_returned_once(self):
+        self.assertEqual(archive.archive_before(self.cutoff, chunk_size=2), 3)
+        self.assertEqual(list(Inquiry.objects.all()), [self.new])
+        # What a run that crashed between writing and deleting leaves behind.
+        Inquiry.objects.bulk_create([Inquiry(pk=self.old[0].pk, transaction_type='sale')])
+        Inquiry.objects.filter(pk=self.old[0].pk).update(created_at=self.cutoff - timedelta(days=1))
+
+        ids = [row['id'] for row in archive.query(transaction_type='sale')]
+        self.assertEqual(sorted(ids), sorted([self.new.pk] + [inquiry.pk for inquiry in self.old]))
+
+    def test_concurrent_run_is_refused(self):
+        directory = archive.archive_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        with archive._exclusive(directory):
+            with self.assertRaises(archive.ArchiveLocked):
+                archive.archive_before(self.cutoff)
+        self.assertEqual(Inquiry.objects.count(), 4)
+
+    def test_archived_rows_are_read_by_date_range(self):
+        created = [self.cutoff - timedelta(days=days) for days in (40, 10, 1)]
+        for inquiry, created_at in zip(self.old, created):
+            Inquiry.objects.filter(pk=inquiry.pk).update(created_at=created_at)
+        archive.archive_before(self.cutoff)
+        self.assertGreaterEqual(InquiryArchive.objects.count(), 2)
+
+        def ids(**kwargs):
+            return [row['id'] for row in archive.iter_archived(**kwargs)]
+
+        self.assertEqual(ids(), [inquiry.pk for inquiry in reversed(self.old)])
+        # The end of the range is exclusive.
+        self.assertEqual(ids(start=created[1], end=created[2]), [self.old[1].pk])
+        self.assertEqual(ids(start=created[0] + timedelta(seconds=1)), [self.old[2].pk, self.old[1].pk])
+        self.assertEqual(ids(end=created[0] + timedelta(seconds=1), transaction_type='rent'), [])
+
+    def test_range_after_the_horizon_reads_only_the_hot_table(self):
+        archive.archive_before(self.cutoff)
+        with mock.patch.object(archive, 'iter_archived') as iter_archived:
+            rows = list(archive.query(start=self.cutoff))
+        iter_archived.assert_not_called()
+        self.assertEqual([row['id'] for row in rows], [self.new.pk])
+        self.assertEqual(len(list(archive.query(start=self.cutoff - timedelta(days=2)))), 4)
+
+
+class BrokerImportTests(TestCase):
+    CSV = (
+        'full_name,email,national_id,phone,password,license_image\n'
+        'Amal Said,amal@example.com,29001011234567,0100000001,s3cret-pass,amal.png\n'
+        'No Email,,29001011234568,0100000002,s3cret-pass,\n'
+    )
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media = media.name
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def stored_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.media)
+            for root, _, names in os.walk(self.media) for name in names
+        )
+
+    def zip_file(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive_file:
+            archive_file.writestr('amal.png', b'image')
+        return buffer.getvalue()
+
+    def test_admin_upload_runs_in_the_task_queue(self):
+        user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pass')
+        self.client.force_login(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/admin/inquiries/brokerimport/add/', {
+                'csv_file': SimpleUploadedFile('brokers.csv', self.CSV.encode()),
+                'images': SimpleUploadedFile('licenses.zip', self.zip_file()),
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(UserProfile.objects.exists())
+        broker_import = BrokerImport.objects.get()
+        self.assertEqual(broker_import.status, BrokerImport.STATUS_QUEUED)
+
+        [claimed] = taskqueue.claim('worker')
+        self.assertEqual(taskqueue.execute(claimed), BackgroundTask.STATUS_DONE)
+        broker_import.refresh_from_db()
+        self.assertEqual(broker_import.status, BrokerImport.STATUS_DONE)
+        self.assertEqual(broker_import.created, 1)
+        self.assertEqual(broker_import.errors, [[3, 'Missing email']])
+        broker = UserProfile.objects.get(email='amal@example.com')
+        # Only the license image is left; the uploads are gone.
+        self.assertEqual(self.stored_files(), [broker.license_image.name])
+        response = self.client.get(f'/admin/inquiries/brokerimport/{broker_import.pk}/change/')
+        self.assertContains(response, 'Line 3: Missing email')
+
+    def test_images_are_removed_when_the_insert_fails(self):
+        with (
+            mock.patch.object(UserProfile.objects, 'bulk_create', side_effect=RuntimeError('disk full')),
+            self.assertRaises(RuntimeError),
+        ):
+            brokerimport.import_brokers(io.StringIO(self.CSV), io.BytesIO(self.zip_file()), workers=1)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_rows_taken_during_the_import_are_dropped_and_the_rest_retried(self):
+        csv_text = self.CSV + 'Badr Ali,badr@example.com,29001011234569,0100000003,s3cret-pass,\n'
+        drop_existing = brokerimport._drop_existing
+
+        def register_amal_after_the_check(chunk, result):
+            available = drop_existing(chunk, result)
+            # Amal registers through the form between the check and the insert.
+            if not UserProfile.objects.filter(email='amal@example.com').exists():
+                UserProfile.objects.create(
+                    full_name='Amal Said', email='amal@example.com', national_id='29001019999999',
+                    phone='0100000009', password='x',
+                )
+            return available
+
+        with mock.patch.object(brokerimport, '_drop_existing', side_effect=register_amal_after_the_check):
+            result = brokerimport.import_brokers(io.StringIO(csv_text), io.BytesIO(self.zip_file()), workers=1)
+        self.assertEqual(result.created, 1)
+        self.assertEqual(result.errors, [(3, 'Missing email'), (2, 'Email already exists')])
+        self.assertTrue(UserProfile.objects.filter(email='badr@example.com').exists())
+        self.assertEqual(self.stored_files(), [])
+
+
+class InquiryEventTests(LookupTestCase):
+
+    def test_event_carries_canonical_names(self):
+        cairo = locations.resolve_city('Cairo')
+        CityAlias.objects.create(city_id=cairo, key='القاهره')
+        with mock.patch('inquiries.events.publish') as publish, self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                '/inquiries/create/',
+                json.dumps({'transaction_type': 'sale', 'city-sale': '  القاهرة ', 'Type-sale': 'villa'}),
+                content_type='application/json',
+            )
+        [(event,), _] = publish.call_args
+        self.assertEqual((event['city'], event['area'], event['property_type']), ('Cairo', '', 'villa'))
+        self.assertEqual(event['city_id'], cairo)
+
+    def test_stream_needs_asgi(self):
+        response = self.client.get('/inquiries/stream/')
+        self.assertEqual(response.status_code, 400)
+
+    async def test_stream_is_served_under_asgi(self):
+        response = await self.async_client.get('/inquiries/stream/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+    def event(self, **fields):
+        return {'id': 1, 'transaction_type': 'sale', 'city_id': 1, 'area_id': None, **fields}
+
+    async def test_hub_delivers_only_to_matching_subscriptions(self):
+        hub = events.Hub()
+        everything, cairo, zamalek, rent = (
+            hub.subscribe(events.Subscription(**filters)) for filters in (
+                {}, {'city_id': 1}, {'city_id': 1, 'area_id': 7}, {'transaction_type': 'rent'},
+            )
+        )
+        hub.dispatch(self.event())
+        hub.dispatch(self.event(id=2, area_id=7))
+        hub.dispatch(self.event(id=3, city_id=2))
+        await asyncio.sleep(0)
+        received = {
+            name: [subscription.queue.get_nowait()['id'] for _ in range(subscription.queue.qsize())]
+            for name, subscription in (('everything', everything), ('cairo', cairo), ('zamalek', zamalek), ('rent', rent))
+        }
+        self.assertEqual(received, {'everything': [1, 2, 3], 'cairo': [1, 2], 'zamalek': [2], 'rent': []})
+        hub.unsubscribe(cairo)
+        self.assertEqual(len(hub), 3)
+
+    async def test_stalled_subscription_keeps_the_newest_events(self):
+        subscription = events.Subscription(queue_size=2)
+        for pk in (1, 2, 3):
+            subscription.deliver(self.event(id=pk))
+        await asyncio.sleep(0)
+        self.assertEqual([subscription.queue.get_nowait()['id'] for _ in range(2)], [2, 3])
+
+    async def test_stream_sends_matching_events(self):
+        backend = events.LocalBackend(events.hub, events.get_config())
+        stream = views._event_stream({'transaction_type': 'sale', 'city_id': 1, 'area_id': None}, events.get_config())
+        with mock.patch.object(events, '_backend', backend):
+            self.assertEqual(await anext(stream), 'retry: 5000\n\n')
+            events.publish(self.event(transaction_type='rent'))
+            events.publish(self.event(id=2, city='Cairo'))
+            chunk = await anext(stream)
+            await stream.aclose()
+        self.assertEqual(len(events.hub), 0)
+        header, data = chunk.rstrip('\n').rsplit('\n', 1)
+        self.assertEqual(header, 'id: 2\nevent: inquiry')
+        self.assertEqual(json.loads(data.removeprefix('data: '))['city'], 'Cairo')
+
+    def test_polling_backend_dispatches_new_inquiries(self):
+        hub = mock.Mock()
+        backend = events.PollingBackend(hub, events.get_config())
+        Inquiry.objects.create(transaction_type='sale', city_id=locations.resolve_city('Cairo'))
+        self.assertEqual(backend.poll(), 0)
+        created = Inquiry.objects.create(transaction_type='rent', city_id=locations.resolve_city('Giza'), bedrooms=2)
+        self.assertEqual(backend.poll(), 1)
+        [(event,), _] = hub.dispatch.call_args
+        self.assertEqual((event['id'], event['city'], event['bedrooms']), (created.pk, 'Giza', 2))
+        self.assertEqual(backend.poll(), 0)
+
+    def test_local_backend_refuses_several_workers(self):
+        with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '4'}), self.assertRaises(ImproperlyConfigured):
+            events.LocalBackend(events.hub, events.get_config())
+
+
+@taskqueue.task(name='tests.slow')
+def slow_task():
+    time.sleep(0.3)
+
+
+class HeartbeatTests(TransactionTestCase):
+
+    def test_running_task_keeps_its_lock_fresh(self):
+        slow_task.delay()
+        [claimed] = taskqueue.claim('worker')
+        long_ago = timezone.now() - timedelta(hours=1)
+        BackgroundTask.objects.filter(pk=claimed.pk).update(locked_at=long_ago)
+        claimed.locked_at = long_ago
+        seen = []
+        with mock.patch.object(taskqueue, 'HEARTBEAT_SECONDS', 0.05):
+            thread = threading.Thread(target=lambda: seen.append(taskqueue.execute(claimed)))
+            thread.start()
+            time.sleep(0.2)
+            self.assertEqual(taskqueue.requeue_stale(600), 0)
+            thread.join()
+        self.assertEqual(seen, [BackgroundTask.STATUS_DONE])
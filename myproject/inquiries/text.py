@@ -0,0 +1,30 @@
+import re
+import unicodedata
+
+# Arabic harakat, superscript alef and tatweel carry no meaning for matching.
+_ARABIC_MARKS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+_ALEF_VARIANTS = str.maketrans({
+    '\u0622': '\u0627',  # alef with madda -> alef
+    '\u0623': '\u0627',  # alef with hamza above -> alef
+    '\u0625': '\u0627',  # alef with hamza below -> alef
+    '\u0671': '\u0627',  # alef wasla -> alef
+    '\u0649': '\u064a',  # alef maksura -> ya
+    '\u0629': '\u0647',  # ta marbuta -> ha
+    '\u0624': '\u0648',  # waw with hamza -> waw
+    '\u0626': '\u064a',  # ya with hamza -> ya
+})
+_NON_WORD = re.compile(r'[^\w]+')
+
+
+def normalize_text(value):
+    """
+    Folds Arabic and English text to a canonical key so that variant
+    spellings ("New Cairo", "new  cairo", "القاهره", "القاهرة") compare equal.
+    """
+    if not value:
+        return ''
+    value = unicodedata.normalize('NFKC', str(value))
+    value = _ARABIC_MARKS.sub('', value)
+    value = value.translate(_ALEF_VARIANTS)
+    value = _NON_WORD.sub(' ', value.casefold()).replace('_', ' ')
+    return ' '.join(value.split())
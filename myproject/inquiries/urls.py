@@ -1,8 +1,12 @@
 from django.urls import path
-from .views import create_inquiry, register_user, login_user, payment_page, process_payment
+from .views import create_inquiry, register_user, login_user, payment_page, process_payment, search_inquiries, broker_leads, inquiry_stream, inquiry_facets
 
 urlpatterns = [
     path('create/', create_inquiry, name='inquiry-create'),
+    path('search/', search_inquiries, name='inquiry-search'),
+    path('leads/', broker_leads, name='broker-leads'),
+    path('facets/', inquiry_facets, name='inquiry-facets'),
+    path('stream/', inquiry_stream, name='inquiry-stream'),
     path('register/', register_user, name='register-user'),
     path('login/', login_user, name='login-user'),
     path('payment/', payment_page, name='payment'),
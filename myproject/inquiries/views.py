@@ -1,5 +1,9 @@
+import asyncio
 import json
-from django.http import JsonResponse, HttpResponse
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.shortcuts import render, redirect
 from django.contrib import messages
@@ -63,6 +67,8 @@ def register_user(request):
 
 
 from .models import Inquiry
+from .locations import resolve_area, resolve_city, resolve_property_type
+from . import events, search
 
 def new_page(request):
     return render(request, 'brokers.html')
@@ -74,11 +80,15 @@ def create_inquiry(request):
         return JsonResponse({'error': 'Method not allowed'}, status=405)
 
     data = json.loads(request.body.decode() or '{}')
+    city = data.get('city-rent') or data.get('city-sale') or ''
+    area = data.get('area-rent') or data.get('area-sale') or ''
+    property_type = data.get('Type-rent') or data.get('Type-sale') or ''
+    city_id = resolve_city(city)
     inquiry = Inquiry.objects.create(
         transaction_type=data.get('transaction_type'),
-        city=data.get('city-rent') or data.get('city-sale') or '',
-        area=data.get('area-rent') or data.get('area-sale') or '',
-        property_type=data.get('Type-rent') or data.get('Type-sale') or '',
+        city_id=city_id,
+        area_id=resolve_area(area, city_id),
+        property_type_id=resolve_property_type(property_type),
         bedrooms=data.get('bedrooms-rent') or data.get('bedrooms-sale'),
         bathrooms=data.get('bathrooms-rent') or data.get('bathrooms-sale'),
         min_price=data.get('min_price-rent') or data.get('min_price-sale'),
@@ -87,8 +97,127 @@ def create_inquiry(request):
         max_size=data.get('max_size-rent') or data.get('max_size-sale'),
         furnished=data.get('Furnished') in ['true', True, 'True']
     )
+    [event] = events.inquiry_events(Inquiry.objects.filter(pk=inquiry.pk))
+    transaction.on_commit(lambda: events.publish(event))
     return JsonResponse({'id': inquiry.id})
 
+
+async def _event_stream(filters, config):
+    subscription = events.subscribe(
+        events.Subscription(queue_size=config['QUEUE_SIZE'], **filters)
+    )
+    try:
+        yield 'retry: 5000\n\n'
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), config['HEARTBEAT_SECONDS'])
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing an idle connection.
+                yield ': keepalive\n\n'
+                continue
+            yield f"id: {event['id']}\nevent: inquiry\ndata: {json.dumps(event)}\n\n"
+    finally:
+        events.hub.unsubscribe(subscription)
+
+
+async def inquiry_stream(request):
+    """
+    Server-sent events feed of new inquiries, optionally narrowed with
+    ``transaction_type``, ``city`` and ``area`` query parameters.
+
+    Only served under ASGI: a WSGI server (runserver included) would tie up
+    a worker thread per subscriber and buffer the endless response.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'The event stream needs an ASGI server'}, status=400)
+
+    filters = {'transaction_type': request.GET.get('transaction_type') or None}
+    filters['city_id'] = await sync_to_async(resolve_city)(request.GET.get('city', ''), create=False)
+    if request.GET.get('city') and filters['city_id'] is None:
+        return JsonResponse({'error': 'Unknown city'}, status=404)
+    filters['area_id'] = await sync_to_async(resolve_area)(
+        request.GET.get('area', ''), filters['city_id'], create=False
+    )
+    if request.GET.get('area') and filters['area_id'] is None:
+        return JsonResponse({'error': 'Unknown area'}, status=404)
+
+    response = StreamingHttpResponse(
+        _event_stream(filters, events.get_config()), content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def _inquiry_json(inquiry, score=None):
+    data = {
+        'id': inquiry.id,
+        'transaction_type': inquiry.transaction_type,
+        'city': inquiry.city.name if inquiry.city else '',
+        'area': inquiry.area.name if inquiry.area else '',
+        'property_type': inquiry.property_type.name if inquiry.property_type else '',
+        'created_at': inquiry.created_at.isoformat(),
+    }
+    if score is not None:
+        data['score'] = score
+    return data
+
+
+def _ranked_json(hits):
+    inquiries = Inquiry.objects.select_related('city', 'area', 'property_type').in_bulk(
+        [pk for pk, _ in hits]
+    )
+    return [_inquiry_json(inquiries[pk], score) for pk, score in hits if pk in inquiries]
+
+
+def _ordered_json(ids):
+    return _ranked_json([(pk, None) for pk in ids])
+
+
+def _limit_param(request, default=20):
+    return min(max(int(request.GET.get('limit', default)), 1), 100)
+
+
+def search_inquiries(request):
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    query = request.GET.get('q', '')
+    try:
+        limit = _limit_param(request)
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer'}, status=400)
+
+    # Ranked by full-text relevance and recency together; see inquiries.search.
+    ids = search.search(query, limit=limit)
+    return JsonResponse({'query': query, 'results': _ordered_json(ids)})
+
+
+def broker_leads(request):
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    try:
+        limit = _limit_param(request)
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer'}, status=400)
+
+    city_id = resolve_city(request.GET.get('city', ''), create=False)
+    if city_id is None:
+        return JsonResponse({'error': 'Unknown city'}, status=404)
+    area_id = None
+    if request.GET.get('area'):
+        area_id = resolve_area(request.GET['area'], city_id, create=False)
+        if area_id is None:
+            return JsonResponse({'error': 'Unknown area'}, status=404)
+
+    # Imported here to keep NumPy out of the URLconf import; warm-up loads it.
+    from . import scoring
+
+    hits = scoring.get_leads(city_id, area_id, limit=limit)
+    return JsonResponse({'results': _ranked_json(hits)})
+
 @csrf_exempt
 def login_user(request):
     if request.method != 'POST':
@@ -173,4 +302,58 @@ def process_payment(request):
         
         return redirect('payment')
     
-    return redirect('payment')
\ No newline at end of file
+    return redirect('payment')
+
+def _form_param(request, name):
+    # The search forms suffix their field names with the transaction type.
+    return (
+        request.GET.get(name) or request.GET.get(f'{name}-rent')
+        or request.GET.get(f'{name}-sale') or ''
+    ).strip()
+
+
+def inquiry_facets(request):
+    """
+    Counts of matching inquiries per city, area, property type, bedroom
+    bucket and price bin for the filters chosen so far in a search form.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    # Imported here to keep NumPy out of the URLconf import; warm-up loads it.
+    from . import facets
+
+    transaction_type = request.GET.get('transaction_type') or None
+    if transaction_type is not None and transaction_type not in facets.TRANSACTIONS:
+        return JsonResponse({'error': 'Unknown transaction type'}, status=400)
+    try:
+        bedrooms = _form_param(request, 'bedrooms')
+        min_price = _form_param(request, 'min_price')
+        max_price = _form_param(request, 'max_price')
+        filters = {
+            'bedrooms': facets.bedroom_bucket(bedrooms) or None,
+            'min_price': int(min_price) if min_price else None,
+            'max_price': int(max_price) if max_price else None,
+        }
+    except ValueError:
+        return JsonResponse({'error': 'bedrooms and prices must be integers'}, status=400)
+    if transaction_type is not None:
+        filters['transaction_type'] = facets.TRANSACTIONS.index(transaction_type)
+
+    # A name nobody has used yet matches nothing; -1 is never a lookup id.
+    city = _form_param(request, 'city')
+    area = _form_param(request, 'area')
+    property_type = _form_param(request, 'property_type') or _form_param(request, 'Type')
+    if city:
+        filters['city'] = resolve_city(city, create=False) or -1
+    if area:
+        filters['area'] = resolve_area(area, filters.get('city'), create=False) or -1
+    if property_type:
+        filters['property_type'] = resolve_property_type(property_type, create=False) or -1
+
+    snapshot = facets.facet_cache.get()
+    if snapshot is None:
+        response = JsonResponse({'error': 'Counts are loading, retry shortly'}, status=503)
+        response['Retry-After'] = '1'
+        return response
+    return JsonResponse(snapshot.counts(filters))
@@ -0,0 +1,163 @@
+"""
+Pays the per-worker start-up costs before the worker accepts traffic, so
+the first requests after a deploy or restart run at steady-state latency.
+
+``myproject.wsgi`` and ``myproject.asgi`` call ``warm_up()`` right after
+building the application; set ``WARMUP_ON_STARTUP = False`` to skip it.
+
+The URL resolver and compiled templates are plain Python objects that
+forked workers share with the process that built them. Database
+connections, the lookup cache and the facet index belong to one process: a server that
+preloads the application (gunicorn ``--preload``) imports this in the
+master and forks the workers from it, and a connection used on both
+sides of a fork corrupts its protocol state. So the master closes its
+connections before each fork and every child opens its own right after.
+Connections survive between requests only with ``CONN_MAX_AGE`` set.
+"""
+import logging
+import os
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.template import engines
+from django.template.exceptions import TemplateDoesNotExist, TemplateSyntaxError
+from django.urls import get_resolver
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_urls():
+    """
+    Builds the URL resolver, which imports every view module, and
+    populates its reverse lookup tables.
+    """
+    resolver = get_resolver()
+    resolver.reverse_dict  # noqa: B018 - populates the resolver
+    return len(resolver.url_patterns)
+
+
+def compile_templates():
+    """
+    Loads every template found in the template directories so the cached
+    loader holds them compiled.
+    """
+    compiled = 0
+    for engine in engines.all():
+        for directory in getattr(engine, 'template_dirs', ()):
+            root = Path(directory)
+            for path in root.rglob('*.html'):
+                try:
+                    engine.get_template(path.relative_to(root).as_posix())
+                except (TemplateDoesNotExist, TemplateSyntaxError) as exc:
+                    logger.warning("Skipping template %s: %s", path, exc)
+                    continue
+                compiled += 1
+    return compiled
+
+
+def open_connections():
+    """
+    Opens a connection per configured database (filling the pool when the
+    backend has one configured) and runs a trivial query on it.
+    """
+    for connection in connections.all():
+        connection.ensure_connection()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    return len(connections.all())
+
+
+def preload_lookups():
+    from .locations import preload
+
+    return preload()
+
+
+def prime_facets():
+    """
+    Imports NumPy with the scoring and facet modules, which the views only
+    import on first use, and builds this process's facet index.
+    """
+    from . import facets, scoring  # noqa: F401
+
+    return facets.facet_cache.prime()
+
+
+# Safe to build once and share with forked workers.
+SHARED_STEPS = (
+    ('urls', resolve_urls),
+    ('templates', compile_templates),
+)
+
+# Must run in the process that serves the requests.
+PROCESS_STEPS = (
+    ('connections', open_connections),
+    ('lookups', preload_lookups),
+    ('facets', prime_facets),
+)
+
+STEPS = SHARED_STEPS + PROCESS_STEPS
+
+# The fork hooks cannot be unregistered, so they check this instead and
+# leave processes that already serve requests (and fork helpers) alone.
+_state = {'hooks_registered': False, 'serving': False}
+
+
+def _run(steps):
+    report = {}
+    for name, step in steps:
+        started = time.perf_counter()
+        try:
+            count = step()
+        except Exception:
+            logger.exception("Warm-up step %r failed", name)
+            continue
+        report[name] = (count, time.perf_counter() - started)
+    return report
+
+
+def _before_fork():
+    if not _state['serving']:
+        connections.close_all()
+
+
+def _after_fork_in_child():
+    if not _state['serving']:
+        logger.info("Worker warm-up after fork finished: %s", _run(PROCESS_STEPS))
+
+
+def _mark_serving(**kwargs):
+    _state['serving'] = True
+
+
+def _register_fork_hooks():
+    if _state['hooks_registered'] or not hasattr(os, 'register_at_fork'):
+        return
+    os.register_at_fork(before=_before_fork, after_in_child=_after_fork_in_child)
+    request_started.connect(_mark_serving, dispatch_uid='inquiries.warmup.serving')
+    _state['hooks_registered'] = True
+
+
+def warm_up():
+    """
+    Runs every warm-up step and returns ``{step: (count, seconds)}``. A
+    failing step is logged and skipped; warm-up must never stop a worker
+    from starting.
+    """
+    report = _run(STEPS)
+    logger.info("Worker warm-up finished: %s", report)
+    return report
+
+
+def warm_up_if_enabled():
+    """
+    Warms up the serving process, and any worker forked from it before the
+    first request, unless ``WARMUP_ON_STARTUP`` is False.
+    """
+    if getattr(settings, 'WARMUP_ON_STARTUP', True):
+        _register_fork_hooks()
+        return warm_up()
+    return {}
@@ -14,3 +14,10 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
 
 application = get_asgi_application()
+
+# Compile templates, build the URL resolver and open database connections
+# before this worker starts accepting requests. When the server forks its
+# workers from this process, each child reopens its own connections.
+from inquiries.warmup import warm_up_if_enabled  # noqa: E402
+
+warm_up_if_enabled()
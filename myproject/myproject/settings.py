@@ -77,6 +77,12 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Keep each worker's connection across requests (the one opened by
+        # inquiries.warmup included) and check it before reuse. On
+        # PostgreSQL, set CONN_MAX_AGE to 0 and OPTIONS = {'pool': True}
+        # to use a psycopg connection pool instead.
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 